@@ -1,27 +1,170 @@
-﻿from fastapi import FastAPI, UploadFile, File, Body
-from fastapi.responses import FileResponse
+﻿from fastapi import FastAPI, UploadFile, File, Body, Depends, Header, Query
+from typing import List, Optional
+from fastapi.responses import FileResponse, JSONResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.concurrency import run_in_threadpool
 from PIL import Image
 
 import os
 import sys
 import csv as _csv
 import gc
+import hashlib
+import heapq
+import io
+import itertools
 import json
+import struct
+import tarfile
+import tempfile
 import threading
 import time
 import urllib.request
+import uuid
+import warnings
+import weakref
+import zipfile
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import numpy as np
 
 # Ensure the local clip/ package is found before any installed 'clip' PyPI package,
 # regardless of whether this file runs as a module (Docker) or as part of a package (local dev).
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 import clip
+from clip.checksums import CHUNK_BYTES, record_sha256, verified_sha256
 
 HF_REPO = "JuicedCooky/continual-learning"
-HF_BASE_URL = f"https://huggingface.co/{HF_REPO}/resolve/main"
+# Point at a mirror (or a local stand-in serving /api/models/... and
+# /<repo>/resolve/main/...) with HF_ENDPOINT, as huggingface_hub does.
+HF_ENDPOINT = os.environ.get("HF_ENDPOINT", "https://huggingface.co").rstrip("/")
+HF_BASE_URL = f"{HF_ENDPOINT}/{HF_REPO}/resolve/main"
+
+# Checkpoints are downloaded DOWNLOAD_WORKERS at a time into <name>.part and
+# renamed into place when complete; an interrupted or truncated file resumes
+# with HTTP Range requests. Files of at least two DOWNLOAD_CHUNK_BYTES are
+# fetched as chunks over up to DOWNLOAD_RANGES parallel connections each.
+DOWNLOAD_WORKERS = int(os.environ.get("DOWNLOAD_WORKERS", 3))
+DOWNLOAD_RANGES = int(os.environ.get("DOWNLOAD_RANGES", 4))
+DOWNLOAD_CHUNK_BYTES = int(os.environ.get("DOWNLOAD_CHUNK_BYTES", 64 * 1024 * 1024))
+# Check checkpoints against the LFS sha256 the HF API lists. Downloads are
+# hashed as they are written; files already on disk are hashed once and the
+# digest is kept in <name>.sha256.json until their size or mtime changes.
+VERIFY_DOWNLOADS = os.environ.get("VERIFY_DOWNLOADS", "1") == "1"
+
+# List the HF repo's checkpoints (cached in models/.remote-manifest.json for
+# REMOTE_MANIFEST_TTL seconds) and download each one the first time it is
+# activated or loaded, instead of fetching everything in initialize_backend().
+# Models a prediction is waiting on are downloaded ahead of background ones.
+LAZY_DOWNLOADS = os.environ.get("LAZY_DOWNLOADS", "1") == "1"
+REMOTE_MANIFEST_TTL = int(os.environ.get("REMOTE_MANIFEST_TTL", 3600))
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 
+# Text features are persisted next to each checkpoint as
+# <name>.textfeat.<manifest hash>.npy (+ a .json manifest naming the prompt
+# template and class list), one file per prompt set, and memory-mapped back
+# in, so restarted workers skip the text tower and share the same page cache.
+# At most TEXT_FEATURE_STORE_SETS sets are kept per checkpoint, least recently
+# used go first. PRECOMPUTE_TEXT_FEATURES builds the store for every
+# checkpoint during initialize_backend().
+PERSIST_TEXT_FEATURES = os.environ.get("PERSIST_TEXT_FEATURES", "1") == "1"
+TEXT_FEATURE_STORE_SETS = int(os.environ.get("TEXT_FEATURE_STORE_SETS", 8))
+PRECOMPUTE_TEXT_FEATURES = os.environ.get("PRECOMPUTE_TEXT_FEATURES", "0") == "1"
+TEXT_FEATURE_DTYPE = os.environ.get("TEXT_FEATURE_DTYPE", "float16")
+
+# Default for /predict's `batched` flag: run the image towers of all active
+# checkpoints as one vmapped pass over their stacked parameters.
+BATCHED_INFERENCE = os.environ.get("BATCHED_INFERENCE", "0") == "1"
+
+# Byte budget for normalized image features kept per (upload hash, checkpoint).
+IMAGE_FEATURE_CACHE_BYTES = int(os.environ.get("IMAGE_FEATURE_CACHE_BYTES", 64 * 1024 * 1024))
+
+# Byte budget for prompt embeddings kept per (checkpoint, prompt template, class list).
+TEXT_FEATURE_CACHE_BYTES = int(os.environ.get("TEXT_FEATURE_CACHE_BYTES", 256 * 1024 * 1024))
+
+# Budget for resident models (parameter bytes). 0 picks a default from the
+# device: 80% of VRAM on CUDA, half of physical RAM on CPU.
+MODEL_CACHE_BYTES = int(os.environ.get("MODEL_CACHE_BYTES", 0))
+
+# Checkpoints selected via /setactivemodels?preload=true or
+# /setsequentialmodels are read from disk by this many background threads.
+MODEL_LOAD_WORKERS = int(os.environ.get("MODEL_LOAD_WORKERS", 4))
+
+# /predict/batch: images decoded+preprocessed concurrently, then encoded in
+# mini-batches of this many images per checkpoint.
+PREPROCESS_WORKERS = int(os.environ.get("PREPROCESS_WORKERS", os.cpu_count() or 4))
+PREDICT_BATCH_SIZE = int(os.environ.get("PREDICT_BATCH_SIZE", 32))
+
+# Uploaded zip/tar archives are refused (before anything is decompressed) if
+# they list more than ARCHIVE_MAX_MEMBERS entries, hold an image larger than
+# ARCHIVE_MAX_MEMBER_BYTES, or their images add up to more than ARCHIVE_MAX_BYTES.
+ARCHIVE_MAX_MEMBERS = int(os.environ.get("ARCHIVE_MAX_MEMBERS", 10000))
+ARCHIVE_MAX_MEMBER_BYTES = int(os.environ.get("ARCHIVE_MAX_MEMBER_BYTES", 32 * 1024 * 1024))
+ARCHIVE_MAX_BYTES = int(os.environ.get("ARCHIVE_MAX_BYTES", 512 * 1024 * 1024))
+
+# "int8" converts every fine-tuned checkpoint's transformer Linear layers to
+# dynamic int8 at load time (CPU only; ignored on CUDA). Roughly quarters the
+# resident size of each cached checkpoint and speeds up CPU forwards; run
+# tools/quantization_report.py to see the accuracy cost on test_images.
+QUANTIZATION = os.environ.get("QUANTIZATION", "none").lower()
+
+# Precision fine-tuned checkpoints run in: "fp32", "bf16" (CPU, or GPUs that
+# support it) or "fp16" (CUDA only); unsupported choices fall back to fp32.
+# MODEL_PRECISION overrides it per checkpoint, e.g.
+# "zscl/dtd.pth=bf16,finetune/mnist.pth=fp32" (also settable at runtime via
+# /setmodelprecision). Reduced precision halves a checkpoint's weight bytes;
+# its text features are persisted in the same precision. Ignored while
+# QUANTIZATION=int8 is active.
+PRECISION = os.environ.get("PRECISION", "fp32").lower()
+MODEL_PRECISION = os.environ.get("MODEL_PRECISION", "")
+PRECISION_DTYPES = {"fp32": "float32", "bf16": "bfloat16", "fp16": "float16"}
+
+# COMPILE=1 runs encode_image/encode_text through torch.compile. The graph
+# takes the weights as inputs, so every checkpoint of one architecture shares
+# it, and the compiled kernels are saved per architecture under
+# COMPILE_CACHE_DIR so restarted workers skip most of the compile time.
+# Quantized models and vmapped batches stay eager, and any compile failure
+# falls back to eager for the rest of the process.
+COMPILE = os.environ.get("COMPILE", "0") == "1"
+COMPILE_CACHE_DIR = os.environ.get("COMPILE_CACHE_DIR", os.path.join(BASE_DIR, "models", ".compile-cache"))
+
+# INFERENCE_BACKEND=onnx runs the encoders of fp32 checkpoints through ONNX
+# Runtime on CPU wherever tools/export_onnx.py has exported them (as
+# <name>.image.onnx / <name>.text.onnx next to the checkpoint); anything
+# else stays on torch. ORT_INTRA_OP_THREADS sets ORT's intra-op thread
+# count (0 lets ORT decide). onnxruntime is only needed for this backend.
+INFERENCE_BACKEND = os.environ.get("INFERENCE_BACKEND", "torch").lower()
+ORT_INTRA_OP_THREADS = int(os.environ.get("ORT_INTRA_OP_THREADS", 0))
+
+# Run attention as one fused scaled_dot_product_attention call per block
+# (causal flag instead of a mask for the text tower) rather than through
+# nn.MultiheadAttention. Parameters and state-dict keys are unchanged;
+# tools/validate_attention.py compares the two implementations.
+FUSED_ATTENTION = os.environ.get("FUSED_ATTENTION", "1") == "1"
+
+# Encode prompts in groups of similar token length, each cut to its own
+# length instead of the padded 77 (see CLIP.encode_text(trim=True)). The
+# causal text tower makes the features identical; most prompts are <16 tokens.
+TRIM_TEXT = os.environ.get("TRIM_TEXT", "1") == "1"
+
+# Memory-map checkpoint files instead of reading them into process memory.
+# Tensors are assigned into the model straight from the mapping, so loading
+# peaks near one model's size and workers on a node share the page cache for
+# the same file. Checkpoints in the legacy (pre zip) format are read normally.
+MMAP_CHECKPOINTS = os.environ.get("MMAP_CHECKPOINTS", "1") == "1"
+
+# Worker processes for tokenizing very large class lists (see clip.tokenize;
+# below clip.clip.POOL_MIN_TEXTS uncached prompts everything stays in-process).
+# 0 disables the pool.
+TOKENIZER_WORKERS = int(os.environ.get("TOKENIZER_WORKERS", 0))
+
+# Per-session state: uploads are kept by content hash within this byte budget,
+# and at most MAX_SESSIONS sessions are remembered (least recently used go first).
+IMAGE_STORE_BYTES = int(os.environ.get("IMAGE_STORE_BYTES", 256 * 1024 * 1024))
+MAX_SESSIONS = int(os.environ.get("MAX_SESSIONS", 1000))
+
 web_app = FastAPI()
 
 origins = [
@@ -39,6 +182,8 @@ web_app.add_middleware(
 
 # --- LAZY LOADING PLACEHOLDERS ---
 torch = None
+ort = None  # onnxruntime, only imported for INFERENCE_BACKEND=onnx
+safe_open = None  # safetensors, optional; .safetensors weights are skipped without it
 device = None
 pre_process = None
 initialized = False
@@ -47,8 +192,6 @@ initialized = False
 # and each independently re-download the full model set.
 _init_lock = threading.Lock()
 
-uploaded_image = None
-
 METHOD_DISPLAY = {
     "finetune": "Finetune",
     "zscl": "ZSCL",
@@ -70,33 +213,80 @@ download_progress = {
 }
 
 # Set while the user has paused downloads; checked between files and
-# from within the urlretrieve reporthook so a pause takes effect mid-file too.
+# between the blocks of every transfer so a pause takes effect mid-file too.
 _download_pause_event = threading.Event()
+_download_lock = threading.Lock()
 
 def _wait_while_paused():
     while _download_pause_event.is_set():
         time.sleep(0.2)
 
+def remote_manifest(refresh=False):
+    """The .pth checkpoints in the HF repo, as [{"hf_path", "rel", "size",
+    "sha256"}]. Served from models/.remote-manifest.json while it is younger
+    than REMOTE_MANIFEST_TTL seconds (unless `refresh`); if the API cannot be
+    reached the cached copy is used however old it is."""
+    manifest_path = os.path.join(BASE_DIR, "models", ".remote-manifest.json")
+    cached = None
+    try:
+        with open(manifest_path, "r", encoding="utf-8") as f:
+            cached = json.load(f)
+    except (OSError, ValueError):
+        pass
+    if cached is not None and not refresh and time.time() - cached["fetched_at"] < REMOTE_MANIFEST_TTL:
+        return cached["files"]
+
+    # blobs=true so each sibling carries its expected size and LFS sha256 —
+    # needed to detect truncated or corrupted local files.
+    api_url = f"{HF_ENDPOINT}/api/models/{HF_REPO}?blobs=true"
+    try:
+        with urllib.request.urlopen(api_url, timeout=30) as r:
+            siblings = json.loads(r.read().decode()).get("siblings", [])
+    except OSError as e:
+        if cached is None:
+            raise
+        print(f"Cannot list {HF_REPO} ({e}); using the model list from {time.ctime(cached['fetched_at'])}")
+        return cached["files"]
+
+    files = [
+        {
+            "hf_path": s["rfilename"],
+            "rel": s["rfilename"][len("models/"):],
+            "size": s.get("size"),
+            "sha256": (s.get("lfs") or {}).get("sha256"),
+        }
+        for s in siblings
+        if s["rfilename"].startswith("models/") and s["rfilename"].endswith(".pth")
+    ]
+    os.makedirs(os.path.dirname(manifest_path), exist_ok=True)
+    tmp_path = f"{manifest_path}.tmp{os.getpid()}"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({"fetched_at": time.time(), "files": files}, f)
+    os.replace(tmp_path, manifest_path)
+    return files
+
+def _discard_bad_copy(local_path, expected_size):
+    """Make way for a fresh download of local_path, keeping a truncated copy
+    as the .part to resume from."""
+    local_size = os.path.getsize(local_path)
+    if expected_size is not None and local_size < expected_size and not os.path.exists(local_path + ".part"):
+        # Whatever made it to disk is a valid prefix; resume from it. Recorded
+        # first: download_file trusts no .part without a state file.
+        _save_download_state(_new_download_state(expected_size, local_size), local_path + ".part.json")
+        os.replace(local_path, local_path + ".part")
+    else:
+        os.remove(local_path)
+
 def download_models_if_missing():
     """Download any .pth files from HuggingFace that aren't present locally."""
     global download_progress
     models_dir = os.path.join(BASE_DIR, "models")
     os.makedirs(models_dir, exist_ok=True)
 
-    # blobs=true so each sibling carries its expected size — needed to detect
-    # local files left truncated by an interrupted/corrupted prior download.
-    api_url = f"https://huggingface.co/api/models/{HF_REPO}?blobs=true"
-    with urllib.request.urlopen(api_url) as r:
-        siblings = json.loads(r.read().decode()).get("siblings", [])
-
-    all_files = []
-    for s in siblings:
-        hf_path = s["rfilename"]
-        if not (hf_path.startswith("models/") and hf_path.endswith(".pth")):
-            continue
-        rel = hf_path[len("models/"):]
-        local_path = os.path.join(models_dir, *rel.split("/"))
-        all_files.append((hf_path, local_path, s.get("size")))
+    all_files = [
+        (f["hf_path"], os.path.join(models_dir, *f["rel"].split("/")), f["size"], f["sha256"])
+        for f in remote_manifest(refresh=True)
+    ]
 
     download_progress = {
         "files": [],
@@ -107,12 +297,18 @@ def download_models_if_missing():
     }
 
     to_download = []
-    for hf_path, local_path, expected_size in all_files:
+    for hf_path, local_path, expected_size, expected_sha256 in all_files:
         fname = os.path.basename(local_path)
         local_size = os.path.getsize(local_path) if os.path.isfile(local_path) else None
         already_present = local_size is not None and (expected_size is None or local_size == expected_size)
+        if already_present and VERIFY_DOWNLOADS and expected_sha256 and \
+                verified_sha256(local_path) != expected_sha256:
+            print(f"{fname} does not match its SHA-256 — re-downloading")
+            os.remove(local_path)
+            local_size, already_present = None, False
         if local_size is not None and not already_present:
             print(f"{fname} is truncated/corrupted on disk ({local_size} != {expected_size} bytes) — re-downloading")
+            _discard_bad_copy(local_path, expected_size)
         file_entry = {
             "name": fname,
             "done": local_size if already_present else 0,
@@ -129,65 +325,428 @@ def download_models_if_missing():
         download_progress["done"] = True
         return
 
-    for hf_path, local_path, file_entry in to_download:
-        _wait_while_paused()
+    expected = {local_path: (size, sha256) for _, local_path, size, sha256 in all_files}
 
-        os.makedirs(os.path.dirname(local_path), exist_ok=True)
+    def fetch(hf_path, local_path, file_entry):
+        _wait_while_paused()
         url = f"{HF_BASE_URL}/{hf_path}"
         print(f"Downloading {url} ...")
-
-        def _reporthook(blocks, block_size, total, _entry=file_entry):
-            _wait_while_paused()
-            if total > 0:
-                _entry["total"] = total
-            _entry["done"] = min(blocks * block_size, total if total > 0 else blocks * block_size)
-
-        urllib.request.urlretrieve(url, local_path, reporthook=_reporthook)
-        file_entry["completed"] = True
-        download_progress["files_done"] += 1
+        size, sha256 = expected[local_path]
+        download_file(url, local_path, size, file_entry, sha256 if VERIFY_DOWNLOADS else None)
+        with _download_lock:
+            file_entry["completed"] = True
+            download_progress["files_done"] += 1
         print(f"Saved {local_path}")
 
+    with ThreadPoolExecutor(max_workers=max(1, DOWNLOAD_WORKERS)) as pool:
+        futures = [pool.submit(fetch, *job) for job in to_download]
+    errors = [f.exception() for f in futures if f.exception() is not None]
+    if errors:
+        # Finished files are in place and partial ones resume on the next call.
+        raise errors[0]
+
     download_progress["done"] = True
 
+class _PrefixHasher(threading.Thread):
+    """SHA-256 of a file that is still being filled in, possibly out of order:
+    hashes, in CHUNK_BYTES blocks, up to the contiguous prefix written so far
+    (read back while it is still in the page cache), so the digest is ready
+    when the last byte lands instead of after a second pass."""
+
+    def __init__(self, path):
+        super().__init__(daemon=True)
+        self.path = path
+        self.sha = hashlib.sha256()
+        self.hashed = 0
+        self.ready = 0
+        self.closed = False
+        self.cond = threading.Condition()
+        self.start()
+
+    def advance(self, ready):
+        with self.cond:
+            if ready > self.ready:
+                self.ready = ready
+                self.cond.notify()
+
+    def close(self):
+        with self.cond:
+            self.closed = True
+            self.cond.notify()
+
+    def run(self):
+        # Unbuffered: a read-ahead buffer would hold bytes not written yet.
+        with open(self.path, "rb", buffering=0) as f:
+            while True:
+                with self.cond:
+                    while self.ready <= self.hashed and not self.closed:
+                        self.cond.wait()
+                    if self.ready <= self.hashed:
+                        return
+                    target = self.ready
+                f.seek(self.hashed)
+                while self.hashed < target:
+                    block = f.read(min(CHUNK_BYTES, target - self.hashed))
+                    if not block:
+                        return  # truncated under us; the size check will fail
+                    self.sha.update(block)
+                    self.hashed += len(block)
+
+    def hexdigest(self):
+        self.close()
+        self.join()
+        return self.sha.hexdigest()
+
+def _written_prefix(state):
+    """Bytes from the start of the file that are already downloaded."""
+    prefix = 0
+    for start, end, done in state["chunks"]:
+        prefix = start + done
+        if end is None or done < end - start:
+            break
+    return prefix
+
+def _open_range(url, start, end=None):
+    """GET url from byte `start` (to `end` exclusive). Returns the response and
+    whether the server honoured the range."""
+    request = urllib.request.Request(url)
+    if start or end is not None:
+        request.add_header("Range", f"bytes={start}-{'' if end is None else end - 1}")
+    response = urllib.request.urlopen(request, timeout=60)
+    return response, response.status == 206
+
+def _read_chunk(url, part_path, chunk, file_entry, state, state_path, hasher, retries=3):
+    """Fill chunk = [start, end, done] of part_path, resuming from `done`.
+    Gives up after `retries` consecutive attempts that made no progress."""
+    start, end, _ = chunk
+    failures = 0
+    while True:
+        _wait_while_paused()
+        before = chunk[2]
+        try:
+            response, ranged = _open_range(url, start + chunk[2], end)
+            # Unbuffered, so recorded progress never runs ahead of the file.
+            with response, open(part_path, "r+b", buffering=0) as f:
+                if not ranged and start + chunk[2] > 0:
+                    if len(state["chunks"]) > 1:
+                        raise RuntimeError(f"{url} does not support range requests")
+                    chunk[2] = 0  # server ignored the range: start the file over
+                f.seek(start + chunk[2])
+                while end is None or chunk[2] < end - start:
+                    _wait_while_paused()
+                    remaining = 1024 * 1024 if end is None else min(1024 * 1024, end - start - chunk[2])
+                    block = response.read(remaining)
+                    if not block:
+                        break
+                    f.write(block)
+                    with _download_lock:
+                        chunk[2] += len(block)
+                        file_entry["done"] = sum(c[2] for c in state["chunks"])
+                        hasher.advance(_written_prefix(state))
+                        if chunk[2] % (4 * 1024 * 1024) < len(block):
+                            _save_download_state(state, state_path)
+            with _download_lock:
+                _save_download_state(state, state_path)
+            if end is None or chunk[2] == end - start:
+                return
+            raise ConnectionError(f"{url} ended {end - start - chunk[2]} bytes early")
+        except OSError as e:
+            failures = 0 if chunk[2] > before else failures + 1
+            if failures > retries:
+                raise
+            print(f"Retrying {os.path.basename(part_path)} from byte {start + chunk[2]}: {e}")
+            time.sleep(2 ** failures)
+
+def _new_download_state(total, prefix=0):
+    """Chunk layout [[start, end, bytes done], ...] for a download of `total`
+    bytes whose first `prefix` bytes are already in the .part file."""
+    if total is not None and total >= 2 * DOWNLOAD_CHUNK_BYTES and DOWNLOAD_RANGES > 1:
+        starts = range(0, total, DOWNLOAD_CHUNK_BYTES)
+        chunks = [[s, min(s + DOWNLOAD_CHUNK_BYTES, total), 0] for s in starts]
+        for chunk in chunks:
+            chunk[2] = max(0, min(prefix - chunk[0], chunk[1] - chunk[0]))
+    else:
+        chunks = [[0, total, prefix]]
+    return {"total": total, "chunks": chunks}
+
+def _save_download_state(state, state_path):
+    with open(state_path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(state, f)
+    os.replace(state_path + ".tmp", state_path)
+
+def download_file(url, local_path, total, file_entry, sha256=None):
+    """Download url to local_path through local_path + ".part", resuming any
+    earlier partial download, and rename it into place once complete. `total`
+    is the expected size and `sha256` the expected digest, if known."""
+    os.makedirs(os.path.dirname(local_path), exist_ok=True)
+    part_path, state_path = local_path + ".part", local_path + ".part.json"
+
+    if total is None:
+        with urllib.request.urlopen(urllib.request.Request(url, method="HEAD"), timeout=60) as r:
+            length = r.headers.get("Content-Length")
+            total = int(length) if length is not None else None
+
+    # Chunk layout: [start, end, bytes done], persisted next to the .part file.
+    state = None
+    try:
+        with open(state_path, "r", encoding="utf-8") as f:
+            state = json.load(f)
+        if state.get("total") != total or not os.path.isfile(part_path):
+            state = None
+    except (OSError, ValueError):
+        pass
+    if state is None:
+        # Without its state a .part may already be extended to full size with
+        # zeros, so none of it can be trusted.
+        state = _new_download_state(total)
+        with open(part_path, "wb"):
+            pass
+        # Before the file is extended: from here on the state is what counts.
+        _save_download_state(state, state_path)
+    if total is not None:
+        with open(part_path, "r+b") as f:
+            f.truncate(total)
+
+    with _download_lock:
+        file_entry["total"] = total or 0
+        file_entry["done"] = sum(c[2] for c in state["chunks"])
+    pending = [c for c in state["chunks"] if c[1] is None or c[2] < c[1] - c[0]]
+    # A resumed download re-reads only what was already on disk.
+    hasher = _PrefixHasher(part_path)
+    hasher.advance(_written_prefix(state))
+    try:
+        if len(pending) > 1:
+            with ThreadPoolExecutor(max_workers=min(DOWNLOAD_RANGES, len(pending))) as pool:
+                for future in [pool.submit(_read_chunk, url, part_path, c, file_entry, state, state_path, hasher)
+                               for c in pending]:
+                    future.result()
+        elif pending:
+            _read_chunk(url, part_path, pending[0], file_entry, state, state_path, hasher)
+    except BaseException:
+        hasher.close()
+        raise
+
+    size = os.path.getsize(part_path)
+    if total is not None and size != total:
+        raise RuntimeError(f"{os.path.basename(local_path)}: downloaded {size} of {total} bytes")
+    hasher.advance(size)
+    digest = hasher.hexdigest()
+    if sha256 is not None and digest != sha256:
+        # Start over next time rather than resuming into a bad file.
+        for path in (part_path, state_path):
+            if os.path.exists(path):
+                os.remove(path)
+        raise RuntimeError(f"{os.path.basename(local_path)}: SHA-256 {digest} does not match {sha256}")
+    os.replace(part_path, local_path)
+    if os.path.exists(state_path):
+        os.remove(state_path)
+    record_sha256(local_path, digest)
+    with _download_lock:
+        file_entry["total"] = file_entry["done"] = size
+
+CHECKPOINT_EXTENSIONS = (".pth", ".safetensors")
+
+def _checkpoints_in(folder):
+    """{file name a checkpoint is known by: file its weights are read from}.
+    A .pth keeps its name; its .safetensors twin (tools/convert_safetensors.py)
+    is read instead once it is at least as new as the .pth."""
+    files = {f for f in os.listdir(folder) if os.path.isfile(os.path.join(folder, f))}
+    found = {}
+    for fname in sorted(files):
+        stem, ext = os.path.splitext(fname)
+        twin = stem + ".safetensors"
+        if ext == ".pth":
+            use_twin = safe_open is not None and twin in files and \
+                os.path.getmtime(os.path.join(folder, twin)) >= os.path.getmtime(os.path.join(folder, fname))
+            found[fname] = twin if use_twin else fname
+        elif ext == ".safetensors" and safe_open is not None and stem + ".pth" not in files:
+            found[fname] = fname
+    return found
+
+def read_safetensors_header(path):
+    """The JSON header of a .safetensors file: tensor name -> {"dtype", "shape",
+    "data_offsets"}, plus "__metadata__". No tensor data is read."""
+    with open(path, "rb") as f:
+        (length,) = struct.unpack("<Q", f.read(8))
+        if length > 100 * 1024 * 1024:
+            raise ValueError(f"{path} is not a safetensors file")
+        return json.loads(f.read(length))
+
+def check_checkpoint_shapes(path):
+    """Raise ValueError if a .safetensors checkpoint does not fit the base
+    architecture, from its header alone."""
+    header = read_safetensors_header(path)
+    expected = {name: list(t.shape) for name, t in get_base_model().state_dict().items()}
+    wrong = [f"{name} {info['shape']} != {expected[name]}" for name, info in header.items()
+             if name in expected and info["shape"] != expected[name]]
+    if wrong:
+        raise ValueError(f"{os.path.basename(path)} does not match {BASE_MODEL_KEY}: {', '.join(wrong[:3])}")
+
 def discover_models():
     """Walk local models/ dir and return sorted list of dicts."""
     models_dir = os.path.join(BASE_DIR, "models")
     root_files = []
     subfolder_files = []
 
-    if not os.path.isdir(models_dir):
-        return []
-
+    os.makedirs(models_dir, exist_ok=True)
+    for entry, weights in _checkpoints_in(models_dir).items():
+        if entry == os.path.basename(_artifact_prefix(BASE_MODEL_KEY)) + ".safetensors":
+            continue  # the converted base model, not a checkpoint
+        display = os.path.splitext(entry)[0].replace("_", " ").replace("-", " ").title()
+        root_files.append({
+            "path": os.path.join(models_dir, entry),
+            "weights": os.path.join(models_dir, weights),
+            "rel": entry,
+            "display_name": display,
+            "group": "base",
+        })
     for entry in os.listdir(models_dir):
         entry_path = os.path.join(models_dir, entry)
-        if os.path.isfile(entry_path) and entry.endswith(".pth"):
-            display = os.path.splitext(entry)[0].replace("_", " ").replace("-", " ").title()
-            root_files.append({
-                "path": entry_path,
-                "rel": entry,
-                "display_name": display,
-                "group": "base",
-            })
-        elif os.path.isdir(entry_path):
-            for fname in os.listdir(entry_path):
-                if fname.endswith(".pth"):
-                    subfolder_files.append({
-                        "path": os.path.join(entry_path, fname),
-                        "rel": f"{entry}/{fname}",
-                        "display_name": make_display_name(entry, fname),
-                        "group": entry,
-                    })
+        if os.path.isdir(entry_path):
+            for fname, weights in _checkpoints_in(entry_path).items():
+                subfolder_files.append({
+                    "path": os.path.join(entry_path, fname),
+                    "weights": os.path.join(entry_path, weights),
+                    "rel": f"{entry}/{fname}",
+                    "display_name": make_display_name(entry, fname),
+                    "group": entry,
+                })
+
+    try:
+        remote = {f["rel"]: f for f in remote_manifest()} if LAZY_DOWNLOADS else {}
+    except OSError as e:
+        print(f"Cannot list {HF_REPO} ({e}); only local models are available")
+        remote = {}
+    for m in root_files + subfolder_files:
+        f = remote.pop(m["rel"], None)
+        # A .pth cut short by an interrupted download still needs fetching.
+        m["remote"] = f is not None and f["size"] is not None and m["weights"] == m["path"] and \
+            os.path.getsize(m["path"]) != f["size"]
+        if m["remote"]:
+            m.update(hf_path=f["hf_path"], size=f["size"], sha256=f["sha256"])
+    for rel, f in remote.items():
+        group, _, fname = rel.rpartition("/")
+        local_path = os.path.join(models_dir, *rel.split("/"))
+        (subfolder_files if group else root_files).append({
+            "path": local_path,
+            "weights": local_path,
+            "rel": rel,
+            "display_name": make_display_name(group, fname) if group else
+                os.path.splitext(fname)[0].replace("_", " ").replace("-", " ").title(),
+            "group": group or "base",
+            "remote": True,
+            "hf_path": f["hf_path"],
+            "size": f["size"],
+            "sha256": f["sha256"],
+        })
 
     root_files.sort(key=lambda x: x["rel"])
     subfolder_files.sort(key=lambda x: x["rel"])
     return root_files + subfolder_files
 
+class ByteBudgetLRU:
+    """Thread-safe LRU mapping that evicts the least recently used entries
+    once the summed `sizeof` of its values exceeds `max_bytes` (None means
+    unbounded). Pinned entries count towards the budget but are never evicted.
+    An entry put with `depends_on` is removed along with any of those keys."""
+
+    def __init__(self, max_bytes, sizeof):
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self.entries = OrderedDict()  # key -> (value, size)
+        self.pinned = set()
+        self.dependents = {}  # key -> keys removed along with it
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value, pinned=False, depends_on=()):
+        """Insert `value`; returns False if it alone exceeds the budget or a
+        key it depends on is not cached."""
+        size = self.sizeof(value)
+        with self.lock:
+            self._remove(key)
+            if not pinned and self.max_bytes is not None and size > self.max_bytes:
+                return False
+            if any(d not in self.entries for d in depends_on):
+                return False
+            self.entries[key] = (value, size)
+            self.bytes += size
+            if pinned:
+                self.pinned.add(key)
+            for d in depends_on:
+                self.dependents.setdefault(d, set()).add(key)
+            self._evict()
+            return True
+
+    def keys(self):
+        with self.lock:
+            return list(self.entries)
+
+    def pop(self, key):
+        with self.lock:
+            entry = self._remove(key)
+            return entry[0] if entry else None
+
+    def resize(self, max_bytes):
+        with self.lock:
+            self.max_bytes = max_bytes
+            self._evict()
+
+    def clear(self):
+        with self.lock:
+            for key in [k for k in self.entries if k not in self.pinned]:
+                self._remove(key)
+
+    def _remove(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.bytes -= entry[1]
+            self.pinned.discard(key)
+        for dependent in self.dependents.pop(key, ()):
+            self._remove(dependent)
+        return entry
+
+    def _evict(self):
+        if self.max_bytes is None:
+            return
+        for key in list(self.entries):
+            if self.bytes <= self.max_bytes:
+                break
+            if key not in self.pinned:
+                self._remove(key)
+                self.evictions += 1
+
+    def stats(self):
+        with self.lock:
+            return {
+                "entries": len(self.entries),
+                "pinned": len(self.pinned),
+                "bytes": self.bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
 # --- LAZY LOADING VARIABLES ---
-model_active_state: dict = {}
 model_paths: list = []
 model_meta: dict = {}
-active_models: list = []
-loaded_models = {}
 
 METHOD_FOLDERS = {
     "finetune": "finetune",
@@ -197,31 +756,495 @@ METHOD_FOLDERS = {
 }
 DATASET_NAMES = ["base", "dtd", "mnist", "eurosat", "flowers"]
 
-sequential_model_paths = []
-include_base_clip = False
+# Per-checkpoint precision overrides, keyed by path relative to models/.
+precision_overrides = dict(
+    (rel.strip(), precision.strip().lower())
+    for rel, _, precision in (item.partition("=") for item in MODEL_PRECISION.split(",") if "=" in item)
+)
 
 def sync_models():
-    global model_paths, active_models, model_active_state, model_meta
+    global model_paths, model_meta
     discovered = discover_models()
-    for i, m in enumerate(discovered):
-        if m["path"] not in model_active_state:
-            model_active_state[m["path"]] = (i == 0)
     model_paths = [m["path"] for m in discovered]
     model_meta = {m["path"]: m for m in discovered}
-    active_models = [1 if model_active_state.get(p, False) else 0 for p in model_paths]
     return discovered
 
-def load_model(model_path):
-    model, _, _ = clip.load("ViT-B/16", device=device, jit=False)
+# --- MODEL FACTORY ---
+# The base ViT-B/16 is loaded through clip.load exactly once and stays
+# resident. Every checkpoint shares its architecture, so fine-tuned models are
+# materialized by assigning their state dict into a meta-device skeleton built
+# from the cached config: the checkpoint is read once and never copied into a
+# separately initialized model.
+base_model = None
+_model_config = None
+_base_model_lock = threading.Lock()
+
+def get_base_model():
+    global base_model, _model_config
+    if base_model is None:
+        with _base_model_lock:
+            if base_model is None:
+                converted = _artifact_prefix(BASE_MODEL_KEY) + ".safetensors"
+                if safe_open is not None and os.path.isfile(converted):
+                    # Skips downloading and unpickling the original JIT archive.
+                    with safe_open(converted, framework="pt", device="cpu") as f:
+                        model = clip.model.build_model({k: f.get_tensor(k) for k in f.keys()}).to(device)
+                else:
+                    model, _, _ = clip.load(BASE_MODEL_KEY, device=device, jit=False)
+                _model_config = clip.model.model_config(model.state_dict())
+                if FUSED_ATTENTION:
+                    clip.model.use_fused_attention(model)
+                base_model = model.eval()
+                model_cache.put(BASE_MODEL_KEY, base_model, pinned=True)
+    return base_model
+
+def _state_tensors(model):
+    # Quantized Linear layers keep their weight and bias as a tuple entry.
+    for value in model.state_dict().values():
+        for t in (value if isinstance(value, tuple) else (value,)):
+            if isinstance(t, torch.Tensor):
+                yield t
+
+def _model_bytes(model):
+    if isinstance(model, (_StackedVisual, _OnnxGraph)):
+        return model.nbytes
+    # Tensors a checkpoint borrowed from the base model cost nothing extra.
+    shared = set() if model is base_model else {t.data_ptr() for t in _state_tensors(base_model)}
+    return sum(t.element_size() * t.nelement() for t in _state_tensors(model) if t.data_ptr() not in shared)
+
+def quantization_enabled():
+    return QUANTIZATION == "int8" and device.type == "cpu"
+
+def precision_supported(precision):
+    if precision == "fp16":
+        return device.type == "cuda"
+    if precision == "bf16":
+        return device.type == "cpu" or torch.cuda.is_bf16_supported()
+    return precision == "fp32"
+
+def model_precision(model_key):
+    """Precision `model_key` runs in. The base model is always fp32, as the
+    source every checkpoint is merged from."""
+    if model_key == BASE_MODEL_KEY or quantization_enabled():
+        return "fp32"
+    meta = model_meta.get(model_key)
+    precision = precision_overrides.get(meta["rel"] if meta else None, PRECISION)
+    return precision if precision_supported(precision) else "fp32"
+
+def _default_model_cache_bytes():
+    if device.type == "cuda":
+        return int(torch.cuda.get_device_properties(device).total_memory * 0.8)
+    try:
+        return int(os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES") * 0.5)
+    except (ValueError, OSError, AttributeError):
+        return None
+
+# --- MODEL CACHE ---
+# Every predict endpoint fetches checkpoints through get_model(). Models are
+# evicted least-recently-used first once their parameter bytes exceed the
+# budget; the base model is pinned.
+model_cache = ByteBudgetLRU(None, _model_bytes)
+
+# --- BACKGROUND LOADING ---
+# Loads run on a thread pool so several checkpoints are read from disk in
+# parallel; only materialization into a skeleton is serialized. Each path has
+# at most one in-flight Future, which get_model() waits on, so a prediction
+# blocks only on the models it actually needs.
+_load_pool = ThreadPoolExecutor(max_workers=MODEL_LOAD_WORKERS, thread_name_prefix="model-load")
+_pending_loads: dict = {}
+_pending_lock = threading.Lock()
+_materialize_lock = threading.Lock()
+model_load_status: dict = {}
+load_jobs = OrderedDict()
+MAX_LOAD_JOBS = 100
+
+def _load_into_cache(model_path):
+    status = model_load_status[model_path]
+    status["state"] = "loading"
+    start = time.perf_counter()
+    try:
+        model = load_model(model_path)
+        if not model_cache.put(model_path, model):
+            print(f"{model_path} exceeds the model cache budget; using it uncached")
+        status.update(state="loaded", load_ms=_ms_since(start))
+        return model
+    except Exception as e:
+        print(f"Failed to load model {model_path}: {e}")
+        status.update(state="failed", error=str(e))
+        raise
+    finally:
+        with _pending_lock:
+            _pending_loads.pop(model_path, None)
+
+def _is_remote(model_path):
+    return model_meta.get(model_path, {}).get("remote", False)
+
+def _copy_outcome(source, target):
+    if source.exception() is not None:
+        target.set_exception(source.exception())
+    else:
+        target.set_result(source.result())
+
+def _load_after_download(model_path, download, future):
+    if download.exception() is not None:
+        model_load_status[model_path] = {"state": "failed", "error": str(download.exception())}
+        with _pending_lock:
+            _pending_loads.pop(model_path, None)
+        future.set_exception(download.exception())
+        return
+    model_load_status[model_path] = {"state": "queued"}
+    _load_pool.submit(_load_into_cache, model_path).add_done_callback(lambda load: _copy_outcome(load, future))
+
+def prefetch_model(model_path, urgent=False):
+    """Queue a background load of `model_path`, downloading it first if it is
+    remote; returns its Future, or None if cached. `urgent` moves the download
+    ahead of background ones."""
+    download = None
+    with _pending_lock:
+        future = _pending_loads.get(model_path)
+        if future is None:
+            if model_path in model_cache:
+                return None
+            if _is_remote(model_path):
+                # Downloads wait in their own queue, not on a load worker.
+                model_load_status[model_path] = {"state": "downloading"}
+                future = _pending_loads[model_path] = Future()
+                download = request_checkpoint(model_path, urgent)
+            else:
+                model_load_status[model_path] = {"state": "queued"}
+                future = _pending_loads[model_path] = _load_pool.submit(_load_into_cache, model_path)
+        elif urgent and _is_remote(model_path):
+            request_checkpoint(model_path, urgent=True)
+    if download is not None:
+        download.add_done_callback(lambda d: _load_after_download(model_path, d, future))
+    return future
+
+def start_load_job(paths):
+    job_id = uuid.uuid4().hex
+    for path in paths:
+        prefetch_model(path)
+    load_jobs[job_id] = list(paths)
+    while len(load_jobs) > MAX_LOAD_JOBS:
+        load_jobs.popitem(last=False)
+    return job_id
+
+def get_model(model_path):
+    model = model_cache.get(model_path)
+    while model is None:
+        future = prefetch_model(model_path, urgent=True)
+        if future is None:
+            model = model_cache.get(model_path)
+        else:
+            model = future.result()
+    return model
+
+# --- ON-DEMAND DOWNLOADS ---
+# With LAZY_DOWNLOADS, remote checkpoints are fetched by DOWNLOAD_WORKERS
+# threads from a priority queue: models a request is waiting on (urgent) go
+# before background preloads, and a queued preload is promoted when a request
+# needs it. One download per checkpoint is ever in flight.
+_download_queue = []  # heap of [priority, seq, model_path]
+_download_jobs = {}  # model_path -> (Future, heap entry)
+_download_cv = threading.Condition()
+_download_seq = itertools.count()
+_download_threads = []
+
+def request_checkpoint(model_path, urgent=False):
+    """Future that resolves once the remote checkpoint `model_path` is on disk."""
+    with _download_cv:
+        job = _download_jobs.get(model_path)
+        if job is None:
+            entry = [0 if urgent else 1, next(_download_seq), model_path]
+            job = _download_jobs[model_path] = (Future(), entry)
+            heapq.heappush(_download_queue, entry)
+            if len(_download_threads) < max(1, DOWNLOAD_WORKERS):
+                thread = threading.Thread(target=_download_worker, name="download", daemon=True)
+                thread.start()
+                _download_threads.append(thread)
+            _download_cv.notify()
+        elif urgent and job[1][0] > 0 and job[1] in _download_queue:
+            job[1][0] = 0
+            heapq.heapify(_download_queue)
+        return job[0]
+
+def fetch_remote_models(paths):
+    """Start downloading every remote checkpoint a request needs, all at once."""
+    for path in paths:
+        if _is_remote(path):
+            request_checkpoint(path, urgent=True)
+
+def _download_worker():
+    while True:
+        with _download_cv:
+            while not _download_queue:
+                _download_cv.wait()
+            model_path = heapq.heappop(_download_queue)[2]
+            future = _download_jobs[model_path][0]
+        try:
+            _fetch_checkpoint(model_path)
+            future.set_result(model_path)
+        except Exception as e:
+            print(f"Failed to download {model_path}: {e}")
+            future.set_exception(e)
+        finally:
+            with _download_cv:
+                _download_jobs.pop(model_path, None)
+
+def _fetch_checkpoint(model_path):
+    global download_progress
+    meta = model_meta[model_path]
+    if not meta.get("remote"):
+        return
+    if os.path.isfile(model_path):
+        if os.path.getsize(model_path) == meta["size"]:
+            meta["remote"] = False  # fetched since model_meta was last rebuilt
+            return
+        _discard_bad_copy(model_path, meta["size"])
+    _wait_while_paused()
+
+    file_entry = {"name": os.path.basename(model_path), "done": 0, "total": meta["size"] or 0, "completed": False}
+    with _download_lock:
+        if download_progress["done"]:
+            download_progress = {
+                "files": [],
+                "files_done": 0,
+                "files_total": 0,
+                "done": False,
+                "paused": _download_pause_event.is_set(),
+            }
+        download_progress["files"].append(file_entry)
+        download_progress["files_total"] += 1
+        download_progress["done"] = False
+
+    url = f"{HF_BASE_URL}/{meta['hf_path']}"
+    print(f"Downloading {url} ...")
+    try:
+        download_file(url, model_path, meta["size"], file_entry, meta["sha256"] if VERIFY_DOWNLOADS else None)
+        file_entry["completed"] = True
+        print(f"Saved {model_path}")
+    except Exception as e:
+        file_entry["error"] = str(e)
+        raise
+    finally:
+        with _download_lock:
+            download_progress["files_done"] = sum(f["completed"] for f in download_progress["files"])
+            download_progress["done"] = all(f["completed"] or "error" in f for f in download_progress["files"])
+    meta["remote"] = False
+    model_meta.get(model_path, meta)["remote"] = False
+
+def model_display_key(model_path):
+    return model_meta.get(model_path, {}).get("rel", os.path.basename(model_path))
+
+def read_checkpoint(model_path):
+    if _is_remote(model_path):
+        request_checkpoint(model_path, urgent=True).result()
+    weights = model_meta.get(model_path, {}).get("weights", model_path)
+    if weights.endswith(".safetensors"):
+        if safe_open is None:
+            raise RuntimeError(f"{weights} needs the safetensors package")
+        check_checkpoint_shapes(weights)
+        # Only the tensors the model has are read, one at a time.
+        wanted = get_base_model().state_dict()
+        with safe_open(weights, framework="pt", device="cpu") as f:
+            return {name: f.get_tensor(name) for name in f.keys() if name in wanted}
+    if MMAP_CHECKPOINTS:
+        try:
+            # Mapped on the CPU; materialize_model() moves tensors to the device.
+            checkpoint = torch.load(model_path, map_location="cpu", mmap=True)
+            return checkpoint["state_dict"]
+        except RuntimeError as e:
+            print(f"Cannot memory-map {model_path} ({e}); reading it instead")
     checkpoint = torch.load(model_path, map_location=device)
-    model.load_state_dict(checkpoint["state_dict"], strict=False)
-    del checkpoint
+    return checkpoint["state_dict"]
+
+def materialize_model(state_dict):
+    base = get_base_model()
+    model = clip.model.build_skeleton(_model_config, FUSED_ATTENTION)
+    merged = {}
+    for name, base_tensor in base.state_dict().items():
+        tensor = state_dict.get(name, state_dict.get(f"module.{name}"))
+        if tensor is None:
+            # Same fallback as the old strict=False load over a base model.
+            tensor = base_tensor
+        elif tensor.dtype != base_tensor.dtype or tensor.device != base_tensor.device:
+            tensor = tensor.to(device=base_tensor.device, dtype=base_tensor.dtype)
+        merged[name] = tensor
+    del state_dict
+
+    model.load_state_dict(merged, assign=True)
     model.eval()
     return model
 
+def load_model(model_path):
+    state_dict = read_checkpoint(model_path)
+    with _materialize_lock:
+        model = materialize_model(state_dict)
+    del state_dict
+    precision = model_precision(model_path)
+    if quantization_enabled():
+        # The base model stays fp32: it is the merge source for every checkpoint.
+        clip.model.quantize_dynamic(model)
+    elif precision != "fp32":
+        # Only this model's parameters are re-pointed; the base keeps its fp32 tensors.
+        clip.model.convert_weights(model, getattr(torch, PRECISION_DTYPES[precision]))
+    return model
+
+# --- COMPILED ENCODERS ---
+# "image"/"text" -> compiled functional_call over one shared skeleton; empty
+# while running eager. functional_call swaps each model's tensors into the
+# skeleton whenever it runs outside a compiled graph (tracing, recompiles,
+# graph breaks), so calls are serialized.
+compiled_encoders: dict = {}
+_compiled_lock = threading.Lock()
+
+def _module_tensors(model):
+    return {**dict(model.named_parameters()), **dict(model.named_buffers())}
+
+def _compile_artifact_path():
+    arch = json.dumps(_model_config, sort_keys=True) + torch.__version__ + device.type
+    return os.path.join(COMPILE_CACHE_DIR, f"clip-{hashlib.sha1(arch.encode()).hexdigest()[:16]}.bin")
+
+def warm_up_compiled_encoders():
+    """Compile both encoders at the base model's shapes, reusing saved kernels."""
+    from torch.func import functional_call
+
+    artifact_path = _compile_artifact_path()
+    if os.path.isfile(artifact_path):
+        try:
+            with open(artifact_path, "rb") as f:
+                torch.compiler.load_cache_artifacts(f.read())
+        except Exception as e:
+            print(f"Ignoring unreadable compile cache {artifact_path}: {e}")
+
+    skeleton = clip.model.build_skeleton(_model_config, FUSED_ATTENTION)
+    compiled = {
+        "image": torch.compile(lambda tensors, pixels: functional_call(skeleton, tensors, (pixels, None))),
+        "text": torch.compile(lambda tensors, tokens: functional_call(skeleton, tensors, (None, tokens))),
+    }
+
+    start = time.perf_counter()
+    try:
+        tensors = _module_tensors(get_base_model())
+        resolution = _model_config["image_resolution"]
+        with torch.no_grad():
+            compiled["image"](tensors, torch.zeros(1, 3, resolution, resolution, device=device))
+            tokens = clip.tokenize(build_prompts(get_session(DEFAULT_SESSION)), workers=TOKENIZER_WORKERS).to(device)
+            if TRIM_TEXT:
+                # Same length buckets as encode_text() will send.
+                clip.model.encode_bucketed(lambda bucket: compiled["text"](tensors, bucket), tokens)
+            else:
+                compiled["text"](tensors, tokens)
+    except Exception as e:
+        print(f"Compiling encoders failed, running eager: {e}")
+        return
+    compiled_encoders.update(compiled)
+    print(f"Compiled encoders ready in {time.perf_counter() - start:.1f}s")
+
+    try:
+        artifacts = torch.compiler.save_cache_artifacts()
+        if artifacts is not None:
+            os.makedirs(COMPILE_CACHE_DIR, exist_ok=True)
+            with open(artifact_path + f".tmp{os.getpid()}", "wb") as f:
+                f.write(artifacts[0])
+            os.replace(artifact_path + f".tmp{os.getpid()}", artifact_path)
+    except Exception as e:
+        print(f"Failed to save compile cache: {e}")
+
+# --- ONNX RUNTIME ---
+# Sessions live in model_cache as ("onnx", model_key, "image"/"text"), counted
+# against the same budget as the torch models and dropped with their model.
+# Missing or stale exports are remembered by the manifest's mtime, so a graph
+# exported while the server runs is picked up on the next request.
+class _OnnxGraph:
+    """An ORT session for one exported encoder, sized by its graph file."""
+
+    def __init__(self, session, nbytes):
+        self.session = session
+        self.nbytes = nbytes
+
+_onnx_unusable = {}  # (model_key, kind) -> .onnx.json mtime when last found unusable
+
+def onnx_manifest(model_key):
+    """What an exported graph pair must match: the checkpoint it came from."""
+    manifest = {"image_resolution": _model_config["image_resolution"]}
+    if model_key != BASE_MODEL_KEY:
+        st = os.stat(model_key)
+        manifest["checkpoint_size"] = st.st_size
+        manifest["checkpoint_mtime"] = st.st_mtime
+    return manifest
+
+def get_onnx_session(model_key, kind):
+    cache_key = ("onnx", model_key, kind)
+    graph = model_cache.get(cache_key)
+    if graph is not None:
+        return graph.session
+
+    prefix = _artifact_prefix(model_key)
+    graph_path = f"{prefix}.{kind}.onnx"
+    try:
+        exported_at = os.path.getmtime(prefix + ".onnx.json")
+    except OSError:
+        exported_at = None
+    if (model_key, kind) in _onnx_unusable and _onnx_unusable[(model_key, kind)] == exported_at:
+        return None
+    try:
+        with open(prefix + ".onnx.json", "r", encoding="utf-8") as f:
+            exported = json.load(f) == onnx_manifest(model_key)
+        if not exported:
+            raise ValueError("export does not match the checkpoint")
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if ORT_INTRA_OP_THREADS:
+            options.intra_op_num_threads = ORT_INTRA_OP_THREADS
+        graph = _OnnxGraph(ort.InferenceSession(graph_path, options, providers=["CPUExecutionProvider"]),
+                           os.path.getsize(graph_path))
+    except (OSError, ValueError) as e:
+        print(f"No usable ONNX {kind} graph for {model_key}: {e}")
+    except Exception as e:
+        print(f"Failed to open {graph_path}: {e}")
+    if graph is None:
+        _onnx_unusable[(model_key, kind)] = exported_at
+        return None
+    _onnx_unusable.pop((model_key, kind), None)
+    # Uncached (and rebuilt next time) if its model is not resident.
+    model_cache.put(cache_key, graph, depends_on=(model_key,))
+    return graph.session
+
+def _run_encoder(kind, model_key, model, inputs):
+    # Exported graphs and compiled kernels are fp32-only; quantized and
+    # reduced-precision models (never the base) run eager.
+    quantized = quantization_enabled() and model is not base_model
+    fp32 = not quantized and model_precision(model_key) == "fp32"
+    if ort is not None and fp32:
+        session = get_onnx_session(model_key, kind)
+        if session is not None:
+            inputs = inputs.float() if kind == "image" else inputs
+            return torch.from_numpy(session.run(None, {"input": inputs.cpu().numpy()})[0]).to(device)
+
+    compiled = compiled_encoders.get(kind)
+    if compiled is not None and fp32:
+        try:
+            with _compiled_lock:
+                return compiled(_module_tensors(model), inputs)
+        except Exception as e:
+            print(f"Compiled {kind} encoder failed, running eager from now on: {e}")
+            compiled_encoders.clear()
+    return model.encode_image(inputs) if kind == "image" else model.encode_text(inputs)
+
+def encode_image(model_key, model, pixels, token_merge=0.0):
+    if token_merge > 0:
+        # Preview mode changes the image tower's shapes per block; always eager.
+        return model.encode_image(pixels, token_merge)
+    return _run_encoder("image", model_key, model, pixels)
+
+def encode_text(model_key, model, tokens):
+    if TRIM_TEXT:
+        return clip.model.encode_bucketed(lambda bucket: _run_encoder("text", model_key, model, bucket), tokens)
+    return _run_encoder("text", model_key, model, tokens)
+
 def initialize_backend():
-    global initialized, loaded_models, model_paths, class_names
-    global torch, device, pre_process
+    global initialized, model_paths, default_class_hash
+    global torch, device, pre_process, ort, safe_open
 
     if initialized:
         return
@@ -231,25 +1254,59 @@ def initialize_backend():
             return
 
         print("Initializing ML assets...")
-        download_models_if_missing()
+        if not LAZY_DOWNLOADS:
+            download_models_if_missing()
 
         import torch
 
         device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
         print(f"Using device: {device} ({'GPU' if device.type == 'cuda' else 'CPU'})")
-        _, _, pre_process = clip.load("ViT-B/16", device=device, jit=False)
+        if QUANTIZATION not in ("none", "int8"):
+            print(f"Unknown QUANTIZATION={QUANTIZATION!r}; running fp32")
+        elif QUANTIZATION == "int8" and not quantization_enabled():
+            print("QUANTIZATION=int8 needs the CPU backend; running unquantized")
+        for precision in {PRECISION, *precision_overrides.values()}:
+            if not precision_supported(precision):
+                print(f"Precision {precision!r} is not supported on {device.type}; those models run fp32")
+        model_cache.resize(MODEL_CACHE_BYTES or _default_model_cache_bytes())
+        if INFERENCE_BACKEND == "onnx":
+            if device.type != "cpu":
+                print("INFERENCE_BACKEND=onnx is CPU only; using torch")
+            else:
+                try:
+                    import onnxruntime as ort
+                except ImportError:
+                    print("INFERENCE_BACKEND=onnx needs onnxruntime; using torch")
+        elif INFERENCE_BACKEND != "torch":
+            print(f"Unknown INFERENCE_BACKEND={INFERENCE_BACKEND!r}; using torch")
+        try:
+            from safetensors import safe_open
+        except ImportError:
+            pass
+        get_base_model()
+        # Sized from the weights actually loaded, which may be a converted file.
+        pre_process = clip.transform(BASE_MODEL_KEY, n_px=_model_config["image_resolution"])
 
         try:
-            class_names = _load_classnames()
+            default_class_hash = register_class_list(_load_classnames())
         except Exception as e:
             print(f"Failed to load classnames: {e}")
-            class_names = ["object"]
+            default_class_hash = register_class_list(["object"])
 
         sync_models()
 
-        if model_paths:
+        if COMPILE:
+            warm_up_compiled_encoders()
+
+        if PRECOMPUTE_TEXT_FEATURES:
+            precompute_text_features()
+
+        if model_paths and _is_remote(model_paths[0]):
+            # Active by default, so fetch it, but without holding up startup.
+            prefetch_model(model_paths[0])
+        elif model_paths:
             try:
-                loaded_models[model_paths[0]] = load_model(model_paths[0])
+                get_model(model_paths[0])
             except Exception as e:
                 print(f"Failed to load default model: {e}")
 
@@ -262,10 +1319,366 @@ def _load_classnames():
     with open(CLASSNAMES_FILE, "r", encoding="utf-8") as f:
         return [l.strip() for l in f.read().splitlines() if l.strip()]
 
-class_names = []
+DEFAULT_PROMPT_PRE = "a photo of a"
+DEFAULT_SESSION = "default"
+
+BASE_MODEL_KEY = "ViT-B/16"
+
+# --- SESSIONS ---
+# Everything a browser tab used to share through module globals (upload,
+# prompt template, class list, model selection) lives in a per-session dict,
+# selected by the X-Session-Id header or ?session_id= (clients that send
+# neither share the "default" session). Uploads and class lists are stored
+# once by content hash and only referenced from sessions, so concurrent
+# requests read shared, immutable data and only ever mutate their own session.
+class_lists: dict = {}
+default_class_hash = None
+image_store = ByteBudgetLRU(IMAGE_STORE_BYTES, len)
+sessions = OrderedDict()
+_sessions_lock = threading.Lock()
+
+def register_class_list(names):
+    digest = _class_list_hash(names)
+    class_lists[digest] = list(names)
+    return digest
+
+def _prune_class_lists():
+    in_use = {default_class_hash} | {s["class_hash"] for s in list(sessions.values())}
+    for digest in [d for d in class_lists if d not in in_use]:
+        class_lists.pop(digest, None)
+
+def get_session(session_id):
+    evicted = []
+    with _sessions_lock:
+        session = sessions.get(session_id)
+        if session is None:
+            session = sessions[session_id] = {
+                "image_id": None,
+                "prompt_pre": DEFAULT_PROMPT_PRE,
+                "prompt_suf": "",
+                "class_hash": None,  # None follows the shared class file
+                "model_active_state": {},
+                "sequential_model_paths": [],
+                "include_base_clip": False,
+            }
+            while len(sessions) > MAX_SESSIONS:
+                oldest = next(k for k in sessions if k != DEFAULT_SESSION)
+                evicted.append(sessions.pop(oldest))
+        sessions.move_to_end(session_id)
+    # A forgotten session's prompt features are freed unless another uses them.
+    for old in evicted:
+        invalidate_text_features(prompt_key(old))
+    return session
+
+def current_session(x_session_id: Optional[str] = Header(None), session_id: Optional[str] = None):
+    return get_session(x_session_id or session_id or DEFAULT_SESSION)
+
+def session_class_names(session):
+    return class_lists.get(session["class_hash"] or default_class_hash, [])
+
+def session_active_paths(session):
+    state = session["model_active_state"]
+    # Until a session picks models, only the first discovered one is active.
+    return [p for i, p in enumerate(model_paths) if state.get(p, i == 0)]
+
+def session_image(session, image_id=None):
+    """Resolve the session's (or an explicit) upload; returns (PreparedImage, error)."""
+    image_id = image_id or session["image_id"]
+    if image_id is None:
+        return None, "No image uploaded yet"
+    content = image_store.get(image_id)
+    if content is None:
+        return None, "Uploaded image has expired; upload it again"
+    return PreparedImage(content, image_id), None
+
+# --- TEXT FEATURE CACHE ---
+# Normalized prompt embeddings ([num_classes, embed_dim]) per checkpoint.
+# Prompts only change on /saveprompt and /saveclassnames, so the text tower
+# runs once per (checkpoint, prompt template, class list) instead of on every
+# prediction. Stale entries can never be hit because the template and class
+# hash are part of the key; invalidate_text_features() just frees them, and
+# prompt sets of forgotten sessions age out of the byte budget.
+def _tensor_bytes(t):
+    return t.element_size() * t.nelement()
+
+text_feature_cache = ByteBudgetLRU(TEXT_FEATURE_CACHE_BYTES, _tensor_bytes)
+
+def _prompt_template(session):
+    prompt_pre = session["prompt_pre"]
+    if prompt_pre.endswith(" "):
+        prompt_pre = prompt_pre[:-1]
+    return prompt_pre, session["prompt_suf"]
+
+def build_prompts(session):
+    prompt_pre, prompt_suf = _prompt_template(session)
+    return [f"{prompt_pre} {name} {prompt_suf}".strip() for name in session_class_names(session)]
+
+def _class_list_hash(names):
+    return hashlib.sha1("\n".join(names).encode("utf-8")).hexdigest()
+
+def prompt_key(session):
+    return _prompt_template(session) + (session["class_hash"] or default_class_hash,)
+
+def invalidate_text_features(key):
+    """Drop cached features for a prompt key no session uses any more."""
+    if any(prompt_key(s) == key for s in list(sessions.values())):
+        return
+    for cache_key in [k for k in text_feature_cache.keys() if k[1:] == key]:
+        text_feature_cache.pop(cache_key)
+
+def _artifact_prefix(model_key):
+    if model_key == BASE_MODEL_KEY:
+        return os.path.join(BASE_DIR, "models", "ViT-B-16")
+    return os.path.splitext(model_key)[0]
+
+def _text_feature_dtype(model_key):
+    precision = model_precision(model_key)
+    return TEXT_FEATURE_DTYPE if precision == "fp32" else PRECISION_DTYPES[precision]
+
+def _text_store_manifest(model_key, key):
+    manifest = {
+        "prompt_pre": key[0],
+        "prompt_suf": key[1],
+        "class_hash": key[2],
+        "dtype": _text_feature_dtype(model_key),
+    }
+    if model_key != BASE_MODEL_KEY:
+        # A re-downloaded checkpoint must not be matched with stale features.
+        st = os.stat(model_key)
+        manifest["checkpoint_size"] = st.st_size
+        manifest["checkpoint_mtime"] = st.st_mtime
+        if quantization_enabled():
+            manifest["quantization"] = QUANTIZATION
+    return manifest
+
+def _text_store_path(model_key, manifest):
+    # The name covers everything the features depend on, so a file can only
+    # ever hold one content; the .json beside it only describes it.
+    digest = hashlib.sha1(json.dumps(manifest, sort_keys=True).encode("utf-8")).hexdigest()[:20]
+    return f"{_artifact_prefix(model_key)}.textfeat.{digest}.npy"
+
+def _load_persisted_text_features(model_key, key):
+    try:
+        manifest = _text_store_manifest(model_key, key)
+        path = _text_store_path(model_key, manifest)
+        array = np.load(path, mmap_mode="r")
+    except (OSError, ValueError):
+        return None
+    try:
+        os.utime(path)  # recency for pruning
+    except OSError:
+        pass
+
+    # The mapping is read-only; torch warns about that but never writes to it.
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        features = torch.from_numpy(array)
+    return features.view(torch.bfloat16) if manifest["dtype"] == "bfloat16" else features
+
+def _persist_text_features(model_key, key, features):
+    prefix = _artifact_prefix(model_key)
+    manifest = _text_store_manifest(model_key, key)
+    path = _text_store_path(model_key, manifest)
+    features = features.cpu().to(getattr(torch, manifest["dtype"]))
+    # NumPy has no bfloat16; its bits are stored as int16 and viewed back on load.
+    array = (features.view(torch.int16) if manifest["dtype"] == "bfloat16" else features).numpy()
+
+    os.makedirs(os.path.dirname(prefix), exist_ok=True)
+    _write_atomic(os.path.splitext(path)[0] + ".json", lambda f: f.write(json.dumps(manifest).encode("utf-8")))
+    _write_atomic(path, lambda f: np.save(f, array))
+    _prune_text_store(model_key, manifest)
+
+def _write_atomic(path, write):
+    # Write-then-rename so concurrently starting workers never map a partial file.
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=os.path.basename(path), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            write(f)
+        os.chmod(tmp_path, 0o644)  # mkstemp makes it owner-only
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+def _prune_text_store(model_key, manifest):
+    """Drop stores built from an older copy of the checkpoint, and all but the
+    TEXT_FEATURE_STORE_SETS most recently used prompt sets."""
+    prefix = _artifact_prefix(model_key)
+    folder, stem = os.path.dirname(prefix), os.path.basename(prefix) + ".textfeat."
+    stores = []
+    for fname in os.listdir(folder):
+        if fname.startswith(stem) and fname.endswith(".npy"):
+            try:
+                stores.append((os.path.getmtime(os.path.join(folder, fname)), fname))
+            except OSError:
+                pass
+    stores.sort(reverse=True)
+    for i, (mtime, fname) in enumerate(stores):
+        # Anything written before the checkpoint last changed can never match again.
+        if i >= TEXT_FEATURE_STORE_SETS or mtime < manifest.get("checkpoint_mtime", 0):
+            for path in (os.path.join(folder, fname), os.path.join(folder, fname[:-len(".npy")] + ".json")):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+def _compute_text_features(model_key, model, prompts):
+    with torch.no_grad():
+        features = encode_text(model_key, model, clip.tokenize(prompts, workers=TOKENIZER_WORKERS).to(device)).float()
+        return (features / features.norm(dim=-1, keepdim=True)).to(model.dtype)
+
+def get_text_features(model_key, model, prompts, key):
+    cache_key = (model_key,) + key
+    features = text_feature_cache.get(cache_key)
+    if features is not None:
+        return features
+
+    if PERSIST_TEXT_FEATURES:
+        features = _load_persisted_text_features(model_key, key)
+    if features is None:
+        features = _compute_text_features(model_key, model, prompts)
+        if PERSIST_TEXT_FEATURES:
+            try:
+                _persist_text_features(model_key, key, features)
+                # Re-read through the mapping so warm and restarted workers
+                # score against the exact same (possibly fp16) matrix.
+                persisted = _load_persisted_text_features(model_key, key)
+                if persisted is not None:
+                    features = persisted
+            except OSError as e:
+                print(f"Failed to persist text features for {model_key}: {e}")
+    features = features.to(device)
+
+    text_feature_cache.put(cache_key, features)
+    return features
+
+def precompute_text_features():
+    """Build the on-disk text-feature store for every discovered checkpoint."""
+    session = get_session(DEFAULT_SESSION)
+    prompts = build_prompts(session)
+    key = prompt_key(session)
+    for model_path in model_paths:
+        if _is_remote(model_path) or _load_persisted_text_features(model_path, key) is not None:
+            continue
+        try:
+            model = model_cache.get(model_path) or load_model(model_path)
+            _persist_text_features(model_path, key, _compute_text_features(model_path, model, prompts))
+            print(f"Precomputed text features for {model_path}")
+        except Exception as e:
+            print(f"Failed to precompute text features for {model_path}: {e}")
+        finally:
+            model = None
+            gc.collect()
+
+# --- IMAGE FEATURE CACHE ---
+# Normalized image features keyed by (SHA-1 of the uploaded bytes, checkpoint),
+# so prompt edits and re-predictions on the same upload skip the image tower.
+image_feature_cache = ByteBudgetLRU(IMAGE_FEATURE_CACHE_BYTES, _tensor_bytes)
+
+class PreparedImage:
+    """Uploaded image bytes and their content hash, decoded and preprocessed
+    on first use (a fully cached prediction never touches the pixels)."""
+
+    def __init__(self, content, digest):
+        self.content = content
+        self.digest = digest
+        self._tensor = None
+
+    @property
+    def tensor(self):
+        if self._tensor is None:
+            image = Image.open(io.BytesIO(self.content))
+            self._tensor = pre_process(image).unsqueeze(0).to(device)
+        return self._tensor
+
+def get_image_features(model_key, model, image, token_merge=0.0):
+    # Token-merged previews are approximate and cached apart from full passes.
+    cache_key = (image.digest, model_key, token_merge) if token_merge > 0 else (image.digest, model_key)
+    features = image_feature_cache.get(cache_key)
+    if features is None:
+        with torch.no_grad():
+            features = encode_image(model_key, model, image.tensor, token_merge)
+            features = features / features.norm(dim=-1, keepdim=True)
+        image_feature_cache.put(cache_key, features)
+    return features
+
+def _rank(prompts, probs):
+    result = dict(zip(prompts, probs.tolist()))
+    return dict(sorted(result.items(), key=lambda item: item[1], reverse=True))
+
+def classify(model_key, model, image, prompts, key, token_merge=0.0):
+    """Score `image` against the cached text features of `model`."""
+    text_features = get_text_features(model_key, model, prompts, key)
+    image_features = get_image_features(model_key, model, image, token_merge)
+    with torch.no_grad():
+        # Scores are always taken in fp32, whatever precision the towers ran in.
+        logits_per_image = model.logit_scale.exp() * image_features.float() @ text_features.t().float()
+        probs = logits_per_image.softmax(dim=-1).cpu().numpy()
+
+    return _rank(prompts, probs[0])
+
+class _StackedVisual:
+    """The image towers of several checkpoints, stacked for one vmapped pass."""
+
+    def __init__(self, models):
+        from torch.func import stack_module_state
+
+        self.models = [weakref.ref(m) for m in models]
+        self.params, self.buffers = stack_module_state([m.visual for m in models])
+        self.skeleton = clip.model.build_skeleton(_model_config, FUSED_ATTENTION).visual
+        # functional_call swaps the stacked tensors into the shared skeleton.
+        self.lock = threading.Lock()
+        self.nbytes = sum(t.element_size() * t.nelement() for t in [*self.params.values(), *self.buffers.values()])
+
+    def built_from(self, models):
+        return len(self.models) == len(models) and all(ref() is m for ref, m in zip(self.models, models))
+
+# Stacked visual parameters of the last model set passed to classify_stacked().
+# Stacking copies every image tower, so the copy lives in model_cache, counted
+# against its budget and dropped as soon as any of its models is evicted, and
+# is rebuilt only when the set (or any of its model objects) changes.
+_stacked_key = None
+_stacked_lock = threading.Lock()
+
+def _get_stacked_visual(model_keys, models):
+    global _stacked_key
+    key = ("stacked",) + tuple(model_keys)
+    with _stacked_lock:
+        stacked = model_cache.get(key) if key == _stacked_key else None
+        if stacked is None or not stacked.built_from(models):
+            if _stacked_key is not None:
+                model_cache.pop(_stacked_key)
+            stacked = _StackedVisual(models)
+            # Too big for the budget, or a member already evicted: use it uncached.
+            _stacked_key = key if model_cache.put(key, stacked, depends_on=model_keys) else None
+        return stacked
+
+def classify_stacked(model_keys, models, image, prompts, key):
+    """classify() for several same-architecture models in one vmapped image pass."""
+    from torch.func import functional_call
+
+    def encode(params, buffers, image):
+        return functional_call(stacked.skeleton, (params, buffers), (image,))
+
+    text_features = [get_text_features(k, m, prompts, key) for k, m in zip(model_keys, models)]
+    cached = [image_feature_cache.get((image.digest, k)) for k in model_keys]
+    with torch.no_grad():
+        if any(f is None for f in cached):
+            stacked = _get_stacked_visual(model_keys, models)
+            with stacked.lock:
+                image_features = torch.vmap(encode, in_dims=(0, 0, None))(
+                    stacked.params, stacked.buffers, image.tensor.type(models[0].dtype))
+            image_features = image_features / image_features.norm(dim=-1, keepdim=True)  # [models, 1, embed_dim]
+            for k, features in zip(model_keys, image_features):
+                image_feature_cache.put((image.digest, k), features.clone())
+        else:
+            image_features = torch.stack(cached)
+        text_features = torch.stack(text_features).float()  # [models, classes, embed_dim]
+        logit_scale = torch.stack([m.logit_scale.exp() for m in models]).view(-1, 1, 1)
+        logits_per_image = logit_scale * image_features.float() @ text_features.transpose(1, 2)
+        probs = logits_per_image.softmax(dim=-1).cpu().numpy()
 
-prompt_pre = "a photo of a"
-prompt_suf = ""
+    return [_rank(prompts, probs[i, 0]) for i in range(len(models))]
 
 @web_app.get("/tsne/base")
 def getTsneBase():
@@ -384,114 +1797,310 @@ def get_device():
         return {"device": "unknown"}
     return {"device": str(device)}
 
+@web_app.post("/session")
+def create_session():
+    session_id = uuid.uuid4().hex
+    get_session(session_id)
+    return {"session_id": session_id}
+
 @web_app.post("/upload")
-async def upload_image(file: UploadFile = File(...)):
-    global uploaded_image
+async def upload_image(file: UploadFile = File(...), session: dict = Depends(current_session)):
     content = await file.read()
-    uploaded_image = Image.open(__import__("io").BytesIO(content))
-    return {"status": "ok"}
+    try:
+        Image.open(io.BytesIO(content)).verify()
+    except Exception as e:
+        return {"error": f"Invalid image: {e}"}
+    image_id = hashlib.sha1(content).hexdigest()
+    image_store.put(image_id, content)
+    session["image_id"] = image_id
+    return {"status": "ok", "image_id": image_id}
+
+@web_app.get("/cache-stats")
+def get_cache_stats():
+    return {
+        "image_features": image_feature_cache.stats(),
+        "text_features": text_feature_cache.stats(),
+        "models": model_cache.stats(),
+        "uploads": image_store.stats(),
+        "sessions": len(sessions),
+    }
+
+def _ms_since(start):
+    return round((time.perf_counter() - start) * 1000, 1)
+
+def _collect_results(events):
+    """Gather (model_name, result, timing) events into the classic response dict."""
+    try:
+        return {model_name: result for model_name, result, _ in events}
+    except Exception as e:
+        print("Error:", e)
+        return {"error": str(e)}
+
+def _stream_results(events):
+    """Emit each model's result as one NDJSON line as soon as it is ready."""
+    def lines():
+        start = time.perf_counter()
+        try:
+            for model_name, result, timing in events:
+                yield json.dumps({"model": model_name, "result": result, **timing}) + "\n"
+        except Exception as e:
+            print("Error:", e)
+            yield json.dumps({"error": str(e)}) + "\n"
+        yield json.dumps({"done": True, "total_ms": _ms_since(start)}) + "\n"
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+def _predict_events(session, image_id, batched, token_merge):
+    prompts = build_prompts(session)
+
+    if not 0 <= token_merge < 1:
+        return {"error": "token_merge must be in [0, 1)"}
+
+    image, error = session_image(session, image_id)
+    if error:
+        return {"error": error}
+
+    active_model_paths = session_active_paths(session)
+
+    if not active_model_paths:
+        return {"error": "No active models selected"}
+
+    return _run_predict(image, prompts, prompt_key(session), active_model_paths, batched, token_merge)
 
+def _run_predict(image, prompts, key, runnable, batched, token_merge=0.0):
+    fetch_remote_models(runnable)
+    # Quantized modules hold packed weights that cannot be stacked for vmap,
+    # stacking needs every model in the same precision, and token merging
+    # runs per model.
+    if batched and len(runnable) > 1 and not quantization_enabled() and not token_merge and \
+            len({model_precision(p) for p in runnable}) == 1:
+        try:
+            start = time.perf_counter()
+            models = [get_model(p) for p in runnable]
+            load_ms = _ms_since(start)
+            start = time.perf_counter()
+            results = classify_stacked(runnable, models, image, prompts, key)
+            timing = {"load_ms": load_ms, "inference_ms": _ms_since(start)}
+            for model_path, result in zip(runnable, results):
+                yield model_display_key(model_path), result, timing
+            return
+        except Exception as e:
+            print(f"Batched inference failed, falling back to per-model passes: {e}")
+
+    for model_path in runnable:
+        model_name = model_display_key(model_path)
+
+        load_ms = 0.0
+        start = time.perf_counter()
+        try:
+            model = get_model(model_path)
+            load_ms = _ms_since(start)
+            start = time.perf_counter()
+            result = classify(model_path, model, image, prompts, key, token_merge)
+        except Exception as e:
+            print(f"Failed to run model {model_name}: {e}")
+            result = {"error": str(e)}
+        yield model_name, result, {"load_ms": load_ms, "inference_ms": _ms_since(start)}
+
+# `token_merge` > 0 is a fast preview: that fraction of the image tokens is
+# merged away in every transformer block (ToMe). Lower latency, approximate
+# scores; tools/benchmark_token_merge.py measures the trade-off.
 @web_app.get("/predict")
-def predict():
-    global uploaded_image, class_names, prompt_pre, prompt_suf, active_models, loaded_models, model_paths
+def predict(batched: bool = BATCHED_INFERENCE, image_id: str = None, token_merge: float = 0.0,
+            session: dict = Depends(current_session)):
+    initialize_backend()
+    events = _predict_events(session, image_id, batched, token_merge)
+    return events if isinstance(events, dict) else _collect_results(events)
 
+@web_app.get("/predict/stream")
+def predict_stream(batched: bool = BATCHED_INFERENCE, image_id: str = None, token_merge: float = 0.0,
+                   session: dict = Depends(current_session)):
     initialize_backend()
+    events = _predict_events(session, image_id, batched, token_merge)
+    return events if isinstance(events, dict) else _stream_results(events)
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".gif", ".webp", ".tif", ".tiff")
+
+class ArchiveTooLarge(ValueError):
+    pass
+
+def _check_archive_member(name, size, count, total):
+    """Raise ArchiveTooLarge once the members seen so far break a limit."""
+    if count > ARCHIVE_MAX_MEMBERS:
+        raise ArchiveTooLarge(f"Archive has more than {ARCHIVE_MAX_MEMBERS} entries")
+    if size > ARCHIVE_MAX_MEMBER_BYTES:
+        raise ArchiveTooLarge(f"{name} is larger than {ARCHIVE_MAX_MEMBER_BYTES} bytes")
+    if total > ARCHIVE_MAX_BYTES:
+        raise ArchiveTooLarge(f"Archive images add up to more than {ARCHIVE_MAX_BYTES} bytes")
+
+def _expand_archive(name, content):
+    """[(name, bytes)] for every image in an uploaded zip/tar, or the file itself.
+    Raises ArchiveTooLarge if the archive breaks the ARCHIVE_MAX_* limits."""
+    if zipfile.is_zipfile(io.BytesIO(content)):
+        with zipfile.ZipFile(io.BytesIO(content)) as archive:
+            # Reads stop at the declared file_size, so checking it up front bounds memory.
+            members, total = [], 0
+            for count, info in enumerate(archive.infolist(), 1):
+                is_image = not info.is_dir() and info.filename.lower().endswith(IMAGE_EXTENSIONS)
+                total += info.file_size if is_image else 0
+                _check_archive_member(info.filename, info.file_size if is_image else 0, count, total)
+                if is_image:
+                    members.append(info)
+            return [(info.filename, archive.read(info)) for info in members]
 
-    if prompt_pre.endswith(" "):
-        prompt_pre = prompt_pre[:-1]
+    try:
+        archive = tarfile.open(fileobj=io.BytesIO(content), mode="r:*")
+    except tarfile.TarError:
+        return [(name, content)]
+    items, total = [], 0
+    with archive:
+        for count, member in enumerate(archive, 1):
+            is_image = member.isfile() and member.name.lower().endswith(IMAGE_EXTENSIONS)
+            total += member.size if is_image else 0
+            _check_archive_member(member.name, member.size if is_image else 0, count, total)
+            if is_image:
+                items.append((member.name, archive.extractfile(member).read()))
+    return items
+
+def _prepare_batch_item(name, content):
+    try:
+        image = PreparedImage(content, hashlib.sha1(content).hexdigest())
+        image.tensor  # preprocess inside the worker
+        return name, image, None
+    except Exception as e:
+        return name, None, str(e)
 
-    prompts = [f"{prompt_pre} {name} {prompt_suf}".strip() for name in class_names]
+def _top_k(prompts, probs, k):
+    values, indices = probs.topk(min(k, probs.shape[-1]))
+    return {prompts[i]: v for v, i in zip(values.tolist(), indices.tolist())}
 
-    if uploaded_image is None:
-        return {"error": "No image uploaded yet"}
+@web_app.post("/predict/batch")
+async def predict_batch(files: List[UploadFile] = File(...), top_k: int = Query(5, ge=1),
+                        batch_size: int = Query(PREDICT_BATCH_SIZE, ge=1), session: dict = Depends(current_session)):
+    """Classify many images (plain files or zip/tar archives) with every active model."""
+    uploads = [(upload.filename, await upload.read()) for upload in files]
+    # The rest, archive expansion included, is CPU-bound; keep it off the event loop.
+    return await run_in_threadpool(_predict_batch, session, uploads, top_k, batch_size)
 
-    active_model_paths = [model_paths[i] for i, is_active in enumerate(active_models) if is_active == 1]
+def _predict_batch(session, uploads, top_k, batch_size):
+    initialize_backend()
 
+    active_model_paths = session_active_paths(session)
     if not active_model_paths:
         return {"error": "No active models selected"}
-
     try:
-        image = pre_process(uploaded_image).unsqueeze(0).to(device)
-        text = clip.tokenize(prompts).to(device)
-        all_results = {}
+        items = [item for name, content in uploads for item in _expand_archive(name, content)]
+    except ArchiveTooLarge as e:
+        return JSONResponse({"error": str(e)}, status_code=413)
+    if not items:
+        return {"error": "No images found in upload"}
 
-        for model_path in active_model_paths:
-            if model_path not in loaded_models:
-                continue
+    prompts = build_prompts(session)
+    key = prompt_key(session)
 
-            model = loaded_models[model_path]
-            model_name = model_meta.get(model_path, {}).get("rel", os.path.basename(model_path))
+    with ThreadPoolExecutor(max_workers=PREPROCESS_WORKERS) as pool:
+        prepared = list(pool.map(lambda item: _prepare_batch_item(*item), items))
 
-            try:
-                with torch.no_grad():
-                    logits_per_image, _ = model(image, text)
-                    probs = logits_per_image.softmax(dim=-1).cpu().numpy()
+    results = [{"name": name, "error": error} if error else {"name": name, "models": {}}
+               for name, _, error in prepared]
+    valid = [(i, image) for i, (_, image, error) in enumerate(prepared) if error is None]
 
-                result = dict(zip(prompts, probs.tolist()[0]))
-                result = dict(sorted(result.items(), key=lambda item: item[1], reverse=True))
-                all_results[model_name] = result
-            except Exception as e:
-                print(f"Failed to run model {model_name}: {e}")
-                all_results[model_name] = {"error": str(e)}
+    for model_path in active_model_paths:
+        model_name = model_display_key(model_path)
+        try:
+            model = get_model(model_path)
+            text_features = get_text_features(model_path, model, prompts, key)
 
-        return all_results
+            missing = [image for _, image in valid if image_feature_cache.get((image.digest, model_path)) is None]
+            for start in range(0, len(missing), batch_size):
+                chunk = missing[start:start + batch_size]
+                with torch.no_grad():
+                    features = encode_image(model_path, model, torch.cat([image.tensor for image in chunk]))
+                    features = features / features.norm(dim=-1, keepdim=True)
+                for image, f in zip(chunk, features):
+                    image_feature_cache.put((image.digest, model_path), f.unsqueeze(0).clone())
 
-    except Exception as e:
-        print("Error:", e)
-        return {"error": str(e)}
+            for i, image in valid:
+                image_features = get_image_features(model_path, model, image)
+                with torch.no_grad():
+                    logits = model.logit_scale.exp() * image_features.float() @ text_features.t().float()
+                    probs = logits.softmax(dim=-1)[0].cpu()
+                results[i]["models"][model_name] = _top_k(prompts, probs, top_k)
+        except Exception as e:
+            print(f"Failed to run model {model_name}: {e}")
+            for i, _ in valid:
+                results[i]["models"][model_name] = {"error": str(e)}
+
+    return {"results": results}
 
 @web_app.get("/getclassnames")
-def getClassNames():
-    global class_names
-    class_names = _load_classnames()
-    return class_names
+def getClassNames(session: dict = Depends(current_session)):
+    global default_class_hash
+    if session["class_hash"] is None:
+        old_key = prompt_key(session)
+        default_class_hash = register_class_list(_load_classnames())
+        if prompt_key(session) != old_key:
+            invalidate_text_features(old_key)
+    return session_class_names(session)
 
 @web_app.get("/getprompt")
-def getPrompt():
-    return {"prefix": prompt_pre, "suffix": prompt_suf}
+def getPrompt(session: dict = Depends(current_session)):
+    return {"prefix": session["prompt_pre"], "suffix": session["prompt_suf"]}
 
 @web_app.post("/saveprompt")
-def savePrompt(data: dict = Body(...)):
-    global prompt_pre, prompt_suf
+def savePrompt(data: dict = Body(...), session: dict = Depends(current_session)):
+    old_key = prompt_key(session)
 
     if isinstance(data, list):
-        prompt_pre = data[0]["prefix"]
-        prompt_suf = data[0]["suffix"]
+        session["prompt_pre"] = data[0]["prefix"]
+        session["prompt_suf"] = data[0]["suffix"]
     else:
-        prompt_pre = data["prefix"]
-        prompt_suf = data["suffix"]
+        session["prompt_pre"] = data["prefix"]
+        session["prompt_suf"] = data["suffix"]
 
+    invalidate_text_features(old_key)
     return {"status": "ok"}
 
 @web_app.post("/saveclassnames")
-async def saveClassNames(data: dict = Body(...)):
-    global class_names
+async def saveClassNames(data: dict = Body(...), session: dict = Depends(current_session)):
+    global default_class_hash
     classes = data["text"]
-    os.makedirs(os.path.dirname(CLASSNAMES_FILE), exist_ok=True)
-    with open(CLASSNAMES_FILE, "w", encoding="utf-8") as f:
-        f.write("\n".join(classes))
-    class_names = [line.strip() for line in classes]
+    old_key = prompt_key(session)
+    class_hash = register_class_list([line.strip() for line in classes])
+
+    if session is sessions.get(DEFAULT_SESSION):
+        # Only the default session owns the shared class file.
+        os.makedirs(os.path.dirname(CLASSNAMES_FILE), exist_ok=True)
+        with open(CLASSNAMES_FILE, "w", encoding="utf-8") as f:
+            f.write("\n".join(classes))
+        default_class_hash = class_hash
+    else:
+        session["class_hash"] = class_hash
+
+    invalidate_text_features(old_key)
+    _prune_class_lists()
     return {"status": "ok"}
 
 @web_app.get("/getmodels")
-def getModels():
+def getModels(session: dict = Depends(current_session)):
     initialize_backend()
     discovered = sync_models()
+    active = set(session_active_paths(session))
     return {
         "models": [
             {
                 "rel": m["rel"],
                 "display_name": m["display_name"],
                 "group": m["group"],
-                "active": model_active_state.get(m["path"], False),
+                "active": m["path"] in active,
+                "precision": model_precision(m["path"]),
+                "remote": m["remote"],
             }
             for m in discovered
         ]
     }
 
 @web_app.post("/setactivemodels")
-def setActiveModels(data: list = Body(...), preload: bool = False):
-    global active_models, loaded_models, model_paths
+def setActiveModels(data: list = Body(...), preload: bool = False, session: dict = Depends(current_session)):
     initialize_backend()
 
     if len(data) != len(model_paths):
@@ -500,82 +2109,123 @@ def setActiveModels(data: list = Body(...), preload: bool = False):
     if not all(v in [0, 1] for v in data):
         return {"error": "Array must contain only 0 or 1 values"}
 
-    active_models = data
-
-    for i, is_active in enumerate(active_models):
-        model_active_state[model_paths[i]] = (is_active == 1)
+    session["model_active_state"] = {path: is_active == 1 for path, is_active in zip(model_paths, data)}
 
-    failed = []
+    # Loads now happen in the background; failures surface via /load-status.
+    response = {"status": "ok", "active": data, "failed": []}
     if preload:
-        for i, is_active in enumerate(active_models):
-            if is_active == 1 and model_paths[i] not in loaded_models:
-                try:
-                    loaded_models[model_paths[i]] = load_model(model_paths[i])
-                except Exception as e:
-                    print(f"Failed to load model {model_paths[i]}: {e}")
-                    failed.append(model_meta.get(model_paths[i], {}).get("rel", os.path.basename(model_paths[i])))
-
-    return {"status": "ok", "active": active_models, "failed": failed}
-
-@web_app.get("/predict_lowmem")
-def predict_lowmem():
-    global uploaded_image, class_names, prompt_pre, prompt_suf, active_models, model_paths
+        response["job_id"] = start_load_job(session_active_paths(session))
+    else:
+        # Activating a remote model starts its download, but not its load.
+        for path in session_active_paths(session):
+            if _is_remote(path):
+                request_checkpoint(path)
+    return response
+
+@web_app.post("/setmodelprecision")
+def setModelPrecision(data: dict = Body(...)):
+    """Override one checkpoint's precision: {"model": "<rel path>", "precision": "fp32" | "bf16" | "fp16" | null}."""
     initialize_backend()
+    sync_models()
 
-    if uploaded_image is None:
-        return {"error": "No image uploaded yet"}
+    path = next((p for p in model_paths if model_meta[p]["rel"] == data.get("model")), None)
+    if path is None:
+        return {"error": f"Unknown model {data.get('model')!r}"}
 
-    active_model_paths = [model_paths[i] for i, is_active in enumerate(active_models) if is_active == 1]
+    precision = data.get("precision")
+    if precision is None:
+        precision_overrides.pop(model_meta[path]["rel"], None)
+    elif not precision_supported(precision):
+        return {"error": f"Precision {precision!r} is not supported on {device.type}"}
+    else:
+        precision_overrides[model_meta[path]["rel"]] = precision
+
+    # The resident copy and its cached features were built in the old precision.
+    model_cache.pop(path)
+    for cache_key in [k for k in text_feature_cache.keys() if k[0] == path]:
+        text_feature_cache.pop(cache_key)
+    for cache_key in [k for k in image_feature_cache.keys() if k[1] == path]:
+        image_feature_cache.pop(cache_key)
+    return {"status": "ok", "model": data["model"], "precision": model_precision(path)}
+
+@web_app.get("/load-status")
+def get_load_status(job_id: str = None):
+    if job_id is None:
+        paths = list(model_load_status)
+    elif job_id in load_jobs:
+        paths = load_jobs[job_id]
+    else:
+        return {"error": "Unknown job id"}
+
+    models = {}
+    for path in paths:
+        status = model_load_status.get(path, {"state": "loaded" if path in model_cache else "unknown"})
+        if path in model_cache:
+            status = {**status, "state": "loaded"}
+        elif status.get("state") == "loaded":
+            status = {**status, "state": "evicted"}
+        models[model_display_key(path)] = status
+    done = all(m["state"] not in ("downloading", "queued", "loading") for m in models.values())
+    failed = {name: m["error"] for name, m in models.items() if m["state"] == "failed"}
+    return {"done": done, "models": models, "failed": failed}
+
+def _predict_lowmem_events(session, image_id):
+    image, error = session_image(session, image_id)
+    if error:
+        return {"error": error}
+
+    active_model_paths = session_active_paths(session)
     if not active_model_paths:
         return {"error": "No active models selected"}
 
-    if prompt_pre.endswith(" "):
-        prompt_pre = prompt_pre[:-1]
-    prompts = [f"{prompt_pre} {name} {prompt_suf}".strip() for name in class_names]
-
-    try:
-        image = pre_process(uploaded_image).unsqueeze(0).to(device)
-        text = clip.tokenize(prompts).to(device)
-        all_results = {}
+    prompts = build_prompts(session)
+    return _run_predict_lowmem(image, prompts, prompt_key(session), active_model_paths)
 
-        for model_path in active_model_paths:
-            model_name = model_meta.get(model_path, {}).get("rel", os.path.basename(model_path))
-            try:
-                model = load_model(model_path)
-                with torch.no_grad():
-                    logits_per_image, _ = model(image, text)
-                    probs = logits_per_image.softmax(dim=-1).cpu().numpy()
-
-                result = dict(zip(prompts, probs.tolist()[0]))
-                result = dict(sorted(result.items(), key=lambda item: item[1], reverse=True))
-                all_results[model_name] = result
-
-                del model
-            except Exception as e:
-                print(f"Failed to run model {model_name}: {e}")
-                all_results[model_name] = {"error": str(e)}
+def _run_predict_lowmem(image, prompts, key, active_model_paths):
+    fetch_remote_models(active_model_paths)
+    evictions = model_cache.evictions
+    for model_path in active_model_paths:
+        model_name = model_display_key(model_path)
+        load_ms = 0.0
+        start = time.perf_counter()
+        try:
+            model = get_model(model_path)
+            load_ms = _ms_since(start)
+            start = time.perf_counter()
+            result = classify(model_path, model, image, prompts, key)
 
-            gc.collect()
+            del model
+        except Exception as e:
+            print(f"Failed to run model {model_name}: {e}")
+            result = {"error": str(e)}
+        yield model_name, result, {"load_ms": load_ms, "inference_ms": _ms_since(start)}
 
+    # Cached models stay resident; only evicted ones leave memory to give back.
+    if model_cache.evictions != evictions:
         gc.collect()
-
         if device.type == "cuda":
             torch.cuda.empty_cache()
 
-        return all_results
+@web_app.get("/predict_lowmem")
+def predict_lowmem(image_id: str = None, session: dict = Depends(current_session)):
+    initialize_backend()
+    events = _predict_lowmem_events(session, image_id)
+    return events if isinstance(events, dict) else _collect_results(events)
 
-    except Exception as e:
-        print("Error:", e)
-        return {"error": str(e)}
+@web_app.get("/predict_lowmem/stream")
+def predict_lowmem_stream(image_id: str = None, session: dict = Depends(current_session)):
+    initialize_backend()
+    events = _predict_lowmem_events(session, image_id)
+    return events if isinstance(events, dict) else _stream_results(events)
 
 @web_app.post("/setsequentialmodels")
-def setSequentialModels(data: dict = Body(...)):
-    global sequential_model_paths, loaded_models, include_base_clip
+def setSequentialModels(data: dict = Body(...), session: dict = Depends(current_session)):
     initialize_backend()
+    sync_models()
 
     models_config = data.get("models", [])
-    sequential_model_paths = []
-    include_base_clip = False
+    sequential_model_paths = session["sequential_model_paths"] = []
+    session["include_base_clip"] = False
 
     if not models_config:
         return {"error": "No models specified"}
@@ -591,7 +2241,7 @@ def setSequentialModels(data: dict = Body(...)):
             continue
 
         if dataset_index == 0 or dataset == "basemodelclip":
-            include_base_clip = True
+            session["include_base_clip"] = True
             loaded_model_names.append("Base CLIP (ViT-B/16)")
             continue
 
@@ -602,84 +2252,68 @@ def setSequentialModels(data: dict = Body(...)):
             return {"error": f"Unknown method: {method}"}
 
         method_folder = METHOD_FOLDERS[method]
-        method_dir = os.path.join(BASE_DIR, "models", method_folder)
         dataset_name = DATASET_NAMES[dataset_index].lower()
 
-        model_file = None
-        if os.path.isdir(method_dir):
-            for fname in sorted(os.listdir(method_dir)):
-                if fname.endswith(".pth") and dataset_name in fname.lower():
-                    model_file = fname
-                    break
+        # model_meta also lists checkpoints that are not downloaded yet.
+        model_path = next((p for p in model_paths if model_meta[p]["group"] == method_folder and
+                           dataset_name in os.path.basename(p).lower()), None)
 
-        if not model_file:
+        if not model_path:
             return {"error": f"Model not found for {config.get('dataset', 'unknown')} with method {method}"}
-
-        model_path = os.path.join(method_dir, model_file)
+        model_file = os.path.basename(model_path)
 
         if model_path not in sequential_model_paths:
             sequential_model_paths.append(model_path)
 
-            if model_path not in loaded_models:
-                try:
-                    loaded_models[model_path] = load_model(model_path)
-                except Exception as e:
-                    return {"error": f"Failed to load model: {str(e)}"}
-
             loaded_model_names.append(f"{method_folder}/{model_file}")
 
-    return {"status": "ok", "models": loaded_model_names}
-
-@web_app.get("/predictsequential")
-def predictSequential():
-    global uploaded_image, class_names, prompt_pre, prompt_suf, sequential_model_paths, loaded_models, include_base_clip
-    initialize_backend()
-
-    if prompt_pre.endswith(" "):
-        prompt_pre = prompt_pre[:-1]
+    return {"status": "ok", "models": loaded_model_names, "job_id": start_load_job(sequential_model_paths)}
 
-    prompts = [f"{prompt_pre} {name} {prompt_suf}".strip() for name in class_names]
+def _predict_sequential_events(session, image_id):
+    prompts = build_prompts(session)
 
-    if uploaded_image is None:
-        return {"error": "No image uploaded yet"}
+    image, error = session_image(session, image_id)
+    if error:
+        return {"error": error}
 
-    if not include_base_clip and not sequential_model_paths:
+    if not session["include_base_clip"] and not session["sequential_model_paths"]:
         return {"error": "No models selected"}
 
-    try:
-        image = pre_process(uploaded_image).unsqueeze(0).to(device)
-        text = clip.tokenize(prompts).to(device)
-        all_results = {}
-
-        if include_base_clip:
-            base_model, _, _ = clip.load("ViT-B/16", device=device, jit=False)
-            with torch.no_grad():
-                logits_per_image, _ = base_model(image, text)
-                probs = logits_per_image.softmax(dim=-1).cpu().numpy()
-            result = dict(zip(prompts, probs.tolist()[0]))
-            result = dict(sorted(result.items(), key=lambda item: item[1], reverse=True))
-            all_results["Base CLIP"] = result
-
-        for model_path in sequential_model_paths:
-            if model_path not in loaded_models:
-                continue
+    return _run_predict_sequential(image, prompts, prompt_key(session), session["include_base_clip"],
+                                   list(session["sequential_model_paths"]))
 
-            model = loaded_models[model_path]
-            model_name = f"{os.path.basename(os.path.dirname(model_path))}/{os.path.basename(model_path)}"
+def _run_predict_sequential(image, prompts, key, with_base, paths):
+    fetch_remote_models(paths)
+    if with_base:
+        start = time.perf_counter()
+        result = classify(BASE_MODEL_KEY, get_base_model(), image, prompts, key)
+        yield "Base CLIP", result, {"load_ms": 0.0, "inference_ms": _ms_since(start)}
 
-            with torch.no_grad():
-                logits_per_image, _ = model(image, text)
-                probs = logits_per_image.softmax(dim=-1).cpu().numpy()
-
-            result = dict(zip(prompts, probs.tolist()[0]))
-            result = dict(sorted(result.items(), key=lambda item: item[1], reverse=True))
-            all_results[model_name] = result
+    for model_path in paths:
+        model_name = f"{os.path.basename(os.path.dirname(model_path))}/{os.path.basename(model_path)}"
+        load_ms = 0.0
+        start = time.perf_counter()
+        try:
+            model = get_model(model_path)
+            load_ms = _ms_since(start)
+            start = time.perf_counter()
+            result = classify(model_path, model, image, prompts, key)
+        except Exception as e:
+            print(f"Failed to run model {model_name}: {e}")
+            result = {"error": str(e)}
+        yield model_name, result, {"load_ms": load_ms, "inference_ms": _ms_since(start)}
 
-        return all_results
+@web_app.get("/predictsequential")
+def predictSequential(image_id: str = None, session: dict = Depends(current_session)):
+    initialize_backend()
+    events = _predict_sequential_events(session, image_id)
+    return events if isinstance(events, dict) else _collect_results(events)
 
-    except Exception as e:
-        print("Error:", e)
-        return {"error": str(e)}
+@web_app.get("/predictsequential/stream")
+def predictSequentialStream(image_id: str = None, session: dict = Depends(current_session)):
+    initialize_backend()
+    events = _predict_sequential_events(session, image_id)
+    return events if isinstance(events, dict) else _stream_results(events)
 
 if __name__ == "__main__":
     import uvicorn
@@ -1 +1,17 @@
-from .clip import *
\ No newline at end of file
+# Submodules and the clip.clip API are imported on first access, so importing
+# this package does not pull in torch, torchvision or the tokenizer.
+import importlib
+
+__all__ = ["available_models", "load", "tokenize", "transform"]
+
+
+def __getattr__(name):
+    if name in ("checksums", "clip", "model", "tokenizer"):
+        return importlib.import_module(f".{name}", __name__)
+    if name in __all__:
+        return getattr(importlib.import_module(".clip", __name__), name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def __dir__():
+    return sorted(list(globals()) + __all__ + ["checksums", "clip", "model", "tokenizer"])
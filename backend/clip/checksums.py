@@ -0,0 +1,54 @@
+import hashlib
+import json
+import os
+
+# Files are hashed in blocks of this size; nothing is read whole.
+CHUNK_BYTES = 1024 * 1024
+
+
+def sha256_file(path: str) -> str:
+    sha = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(CHUNK_BYTES), b""):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+def _sidecar(path: str) -> str:
+    return path + ".sha256.json"
+
+
+def recorded_sha256(path: str):
+    """The SHA-256 recorded for `path`, if the file still has the size and
+    mtime it had when it was recorded; otherwise None."""
+    try:
+        with open(_sidecar(path), "r", encoding="utf-8") as f:
+            entry = json.load(f)
+        st = os.stat(path)
+    except (OSError, ValueError):
+        return None
+    if entry.get("size") != st.st_size or entry.get("mtime_ns") != st.st_mtime_ns:
+        return None
+    return entry.get("sha256")
+
+
+def record_sha256(path: str, digest: str):
+    """Remember that `path`, as it is now, hashes to `digest`."""
+    st = os.stat(path)
+    entry = {"size": st.st_size, "mtime_ns": st.st_mtime_ns, "sha256": digest}
+    tmp_path = f"{_sidecar(path)}.tmp{os.getpid()}"
+    try:
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(entry, f)
+        os.replace(tmp_path, _sidecar(path))
+    except OSError:
+        pass  # a read-only directory only costs a re-hash next time
+
+
+def verified_sha256(path: str) -> str:
+    """SHA-256 of `path`, hashed at most once per size/mtime."""
+    digest = recorded_sha256(path)
+    if digest is None:
+        digest = sha256_file(path)
+        record_sha256(path, digest)
+    return digest
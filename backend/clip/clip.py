@@ -1,20 +1,26 @@
 # Code ported from https://github.com/openai/CLIP
 
 import hashlib
+import multiprocessing
 import os
 import urllib
 import warnings
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
 from typing import Union, List
 
+import numpy as np
 import torch
 from torchvision.transforms import Compose, Resize, CenterCrop, ToTensor, Normalize, RandomResizedCrop, InterpolationMode
 from tqdm import tqdm
 
+from .checksums import CHUNK_BYTES, record_sha256, verified_sha256
 from .model import build_model
 from .tokenizer import SimpleTokenizer as _Tokenizer
 
-__all__ = ["available_models", "load", "tokenize"]
-_tokenizer = _Tokenizer()
+__all__ = ["available_models", "load", "tokenize", "transform"]
 
 _MODELS = {
     "RN50": "https://openaipublic.azureedge.net/clip/models/afeb0e10f9e5a86da6080e35cf09123aca3b358a0c3e3b6c78a7b63bc04b6762/RN50.pt",
@@ -37,26 +43,38 @@ def _download(url: str, root: str = os.path.expanduser("~/.cache/clip")):
         raise RuntimeError(f"{download_target} exists and is not a regular file")
 
     if os.path.isfile(download_target):
-        if hashlib.sha256(open(download_target, "rb").read()).hexdigest() == expected_sha256:
+        # Hashed once; later calls trust the recorded digest while size and mtime match.
+        if verified_sha256(download_target) == expected_sha256:
             return download_target
         else:
             warnings.warn(f"{download_target} exists, but the SHA256 checksum does not match; re-downloading the file")
 
-    with urllib.request.urlopen(url) as source, open(download_target, "wb") as output:
+    # Hashed as it is written, into a .part file that only replaces the target once verified.
+    sha = hashlib.sha256()
+    part_target = download_target + ".part"
+    with urllib.request.urlopen(url) as source, open(part_target, "wb") as output:
         with tqdm(total=int(source.info().get("Content-Length")), ncols=80, unit='iB', unit_scale=True) as loop:
             while True:
-                buffer = source.read(8192)
+                buffer = source.read(CHUNK_BYTES)
                 if not buffer:
                     break
 
                 output.write(buffer)
+                sha.update(buffer)
                 loop.update(len(buffer))
 
-    if hashlib.sha256(open(download_target, "rb").read()).hexdigest() != expected_sha256:
+    if sha.hexdigest() != expected_sha256:
+        os.remove(part_target)
         raise RuntimeError(f"Model has been downloaded but the SHA256 checksum does not not match")
 
+    os.replace(part_target, download_target)
+    record_sha256(download_target, expected_sha256)
     return download_target
 
+# Input resolution of the models in _MODELS that do not take 224px images.
+_RESOLUTIONS = {"RN50x4": 288, "RN50x16": 384}
+
+
 def _convert_to_rgb(image):
     return image.convert('RGB')
 
@@ -84,6 +102,14 @@ def available_models() -> List[str]:
     """Returns the names of available CLIP models"""
     return list(_MODELS.keys())
 
+
+def transform(name: str, is_train: bool = False, n_px: int = None):
+    """The preprocess transform `load(name)` returns, without loading the model.
+    `n_px` overrides the resolution, e.g. with the one the loaded weights take."""
+    if name not in _MODELS:
+        raise RuntimeError(f"Model {name} not found; available models = {available_models()}")
+    return _transform(n_px or _RESOLUTIONS.get(name, 224), is_train=is_train)
+
 # def load(name: str, device: Union[str, torch.device] = "cuda" if torch.cuda.is_available() else "cpu", jit: bool = False, download_root: str = None):
 #     """Load a CLIP model
 
@@ -281,7 +307,77 @@ def load(name: str, device: Union[str, torch.device] = "cuda" if torch.cuda.is_a
            _transform(model.input_resolution.item(), is_train=False)
 
 
-def tokenize(texts: Union[str, List[str]], context_length: int = 77) -> torch.LongTensor:
+# Token ids of recently tokenized prompts. Editing one class name re-tokenizes
+# only the prompt that changed.
+TOKEN_CACHE_SIZE = 65536
+
+# tokenize(workers=N) only starts worker processes for at least this many
+# uncached texts; below it the pool costs more than it saves.
+POOL_MIN_TEXTS = 4096
+
+_token_cache = OrderedDict()
+_token_cache_lock = threading.Lock()
+_pool = None
+_pool_workers = 0
+_pool_lock = threading.Lock()
+
+
+@lru_cache()
+def _get_tokenizer() -> _Tokenizer:
+    # Built on first use, not at import: a freshly started worker only pays
+    # for it once it actually has prompts to encode.
+    return _Tokenizer()
+
+
+def _encode_uncached(text: str) -> tuple:
+    tokenizer = _get_tokenizer()
+    sot_token = tokenizer.encoder["<start_of_text>"]
+    eot_token = tokenizer.encoder["<end_of_text>"]
+    return (sot_token, *tokenizer.encode(text), eot_token)
+
+
+def _encode_chunk(texts: List[str]) -> List[tuple]:
+    return [_encode_uncached(text) for text in texts]
+
+
+def _remember(text: str, tokens: tuple):
+    with _token_cache_lock:
+        _token_cache[text] = tokens
+        _token_cache.move_to_end(text)
+        while len(_token_cache) > TOKEN_CACHE_SIZE:
+            _token_cache.popitem(last=False)
+
+
+def _encode(text: str) -> tuple:
+    with _token_cache_lock:
+        tokens = _token_cache.get(text)
+        if tokens is not None:
+            _token_cache.move_to_end(text)
+            return tokens
+    tokens = _encode_uncached(text)
+    _remember(text, tokens)
+    return tokens
+
+
+def _encode_parallel(texts: List[str], workers: int) -> List[tuple]:
+    global _pool, _pool_workers
+    size = -(-len(texts) // workers)
+    chunks = [texts[i:i + size] for i in range(0, len(texts), size)]
+    with _pool_lock:
+        if _pool is None or _pool_workers != workers:
+            if _pool is not None:
+                _pool.shutdown()
+            # Spawned, not forked: callers are multithreaded servers, and a
+            # fork would copy whatever locks torch/ORT threads hold.
+            _pool = ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("spawn"))
+            _pool_workers = workers
+        # map() submits every chunk before returning, so the pool cannot be
+        # swapped out from under it once the lock is released.
+        results = _pool.map(_encode_chunk, chunks)
+    return [tokens for chunk in results for tokens in chunk]
+
+
+def tokenize(texts: Union[str, List[str]], context_length: int = 77, workers: int = 0) -> torch.LongTensor:
     """
     Returns the tokenized representation of given input string(s)
     Parameters
@@ -290,6 +386,9 @@ def tokenize(texts: Union[str, List[str]], context_length: int = 77) -> torch.Lo
         An input string or a list of input strings to tokenize
     context_length : int
         The context length to use; all CLIP models use 77 as the context length
+    workers : int
+        Encode uncached texts in this many worker processes when there are at
+        least POOL_MIN_TEXTS of them (0 or 1: always in this process)
     Returns
     -------
     A two-dimensional tensor containing the resulting tokens, shape = [number of input strings, context_length]
@@ -297,14 +396,19 @@ def tokenize(texts: Union[str, List[str]], context_length: int = 77) -> torch.Lo
     if isinstance(texts, str):
         texts = [texts]
 
-    sot_token = _tokenizer.encoder["<start_of_text>"]
-    eot_token = _tokenizer.encoder["<end_of_text>"]
-    all_tokens = [[sot_token] + _tokenizer.encode(text) + [eot_token] for text in texts]
-    result = torch.zeros(len(all_tokens), context_length, dtype=torch.long)
-
-    for i, tokens in enumerate(all_tokens):
-        if len(tokens) > context_length: # Truncate
-            tokens = tokens[:context_length]
-        result[i, :len(tokens)] = torch.tensor(tokens)
-
-    return result
\ No newline at end of file
+    if workers > 1:
+        # Only pay for the pool when enough texts actually miss the cache.
+        with _token_cache_lock:
+            misses = [text for text in dict.fromkeys(texts) if text not in _token_cache]
+        if len(misses) >= POOL_MIN_TEXTS:
+            for text, tokens in zip(misses, _encode_parallel(misses, workers)):
+                _remember(text, tokens)
+
+    all_tokens = [_encode(text) for text in texts]
+    lengths = np.minimum([len(tokens) for tokens in all_tokens], context_length)
+    result = np.zeros((len(all_tokens), context_length), dtype=np.int64)
+    # Truncate, then scatter every row's ids in one assignment.
+    flat = np.fromiter((t for tokens, n in zip(all_tokens, lengths) for t in tokens[:n]),
+                       dtype=np.int64, count=int(lengths.sum()))
+    result[np.arange(context_length) < lengths[:, None]] = flat
+    return torch.from_numpy(result)
@@ -179,16 +179,78 @@ class ResidualAttentionBlock(nn.Module):
         ]))
         self.ln_2 = LayerNorm(d_model)
         self.attn_mask = attn_mask
-
-    def attention(self, x: torch.Tensor):
-        self.attn_mask = self.attn_mask.to(dtype=x.dtype, device=x.device) if self.attn_mask is not None else None
-        return self.attn(x, x, x, need_weights=False, attn_mask=self.attn_mask)[0]
+        # Set by use_fused_attention() when attn_mask is the plain causal mask.
+        self.is_causal = False
+
+    def attention(self, x: torch.Tensor, attn_bias: torch.Tensor = None):
+        if self.is_causal:
+            return self.attn(x, x, x, need_weights=False, is_causal=True)[0]
+        attn_mask = self.attn_mask
+        if attn_mask is not None:
+            if attn_mask.dtype != x.dtype or attn_mask.device != x.device:
+                attn_mask = self.attn_mask = attn_mask.to(dtype=x.dtype, device=x.device)
+            # Trimmed text batches are shorter than the mask was built for.
+            attn_mask = attn_mask[:x.shape[0], :x.shape[0]]
+        if attn_bias is not None:
+            # [batch, length] added to every query's logits for that key.
+            attn_bias = attn_bias.to(x.dtype)
+            if type(self.attn) is nn.MultiheadAttention:
+                attn_bias = attn_bias.repeat_interleave(self.attn.num_heads, 0)[:, None, :].expand(-1, x.shape[0], -1)
+            else:
+                attn_bias = attn_bias[:, None, None, :]
+            attn_mask = attn_bias if attn_mask is None else attn_mask + attn_bias
+        return self.attn(x, x, x, need_weights=False, attn_mask=attn_mask)[0]
 
     def forward(self, x: torch.Tensor):
         x = x + self.attention(self.ln_1(x))
         x = x + self.mlp(self.ln_2(x))
         return x
 
+    def forward_merged(self, x: torch.Tensor, size: torch.Tensor, ratio: float):
+        """forward() with token merging (ToMe) between attention and MLP.
+
+        `size` ([length, batch, 1]) counts the original tokens each row stands
+        for; attention is weighted by it (proportional attention) and both
+        come back shorter by `merge_tokens`.
+        """
+        x = x + self.attention(self.ln_1(x), size[..., 0].t().log())
+        x, size = merge_tokens(x, size, ratio)
+        x = x + self.mlp(self.ln_2(x))
+        return x, size
+
+
+def merge_tokens(x: torch.Tensor, size: torch.Tensor, ratio: float):
+    """ToMe bipartite soft matching on [length, batch, width] tokens.
+
+    Patch tokens are split alternately into two sets; each token of the first
+    set is paired with its most similar (cosine) token of the second, and the
+    `ratio` * length best pairs are averaged together, weighted by `size`.
+    At most half the patches can merge per call; the class token never does.
+    """
+    r = min(int((x.shape[0] - 1) * ratio), (x.shape[0] - 1) // 2)
+    if r <= 0:
+        return x, size
+
+    x, size = x.transpose(0, 1), size.transpose(0, 1)  # work in [batch, length, *]
+    with torch.no_grad():
+        metric = x[:, 1:] / x[:, 1:].norm(dim=-1, keepdim=True)
+        scores = metric[:, ::2] @ metric[:, 1::2].transpose(1, 2)
+        best, best_idx = scores.max(dim=-1)
+        order = best.argsort(dim=-1, descending=True)[..., None]
+        src_idx, keep_idx = order[:, :r], order[:, r:]
+        dst_idx = best_idx[..., None].gather(1, src_idx)
+
+    def merge(t):
+        src, dst = t[:, 1:][:, ::2], t[:, 1:][:, 1::2]
+        width = t.shape[-1]
+        kept = src.gather(1, keep_idx.expand(-1, -1, width))
+        dst = dst.scatter_reduce(1, dst_idx.expand(-1, -1, width), src.gather(1, src_idx.expand(-1, -1, width)), "sum")
+        return torch.cat([t[:, :1], kept, dst], dim=1)
+
+    x = merge(x * size)
+    size = merge(size)
+    return (x / size).transpose(0, 1), size.transpose(0, 1)
+
 
 class Transformer(nn.Module):
     def __init__(self, width: int, layers: int, heads: int, attn_mask: torch.Tensor = None):
@@ -224,7 +286,9 @@ class VisualTransformer(nn.Module):
         self.ln_post = LayerNorm(width)
         self.proj = nn.Parameter(scale * torch.randn(width, output_dim))
 
-    def forward(self, x: torch.Tensor):
+    def forward(self, x: torch.Tensor, token_merge: float = 0.0):
+        """`token_merge` > 0 merges that fraction of the tokens in every block
+        (see `merge_tokens`): faster and approximate."""
         x = self.conv1(x)  # shape = [*, width, grid, grid]
         x = x.reshape(x.shape[0], x.shape[1], -1)  # shape = [*, width, grid ** 2]
         x = x.permute(0, 2, 1)  # shape = [*, grid ** 2, width]
@@ -233,7 +297,12 @@ class VisualTransformer(nn.Module):
         x = self.ln_pre(x)
 
         x = x.permute(1, 0, 2)  # NLD -> LND
-        x = self.transformer(x)
+        if token_merge > 0:
+            size = x.new_ones(x.shape[0], x.shape[1], 1)
+            for block in self.transformer.resblocks:
+                x, size = block.forward_merged(x, size, token_merge)
+        else:
+            x = self.transformer(x)
         x = x.permute(1, 0, 2)  # LND -> NLD
 
         x = self.ln_post(x[:, 0, :])
@@ -344,13 +413,25 @@ class CLIP(nn.Module):
     def dtype(self):
         return self.visual.conv1.weight.dtype
 
-    def encode_image(self, image):
+    def encode_image(self, image, token_merge: float = 0.0):
+        if token_merge > 0:
+            return self.visual(image.type(self.dtype), token_merge)
         return self.visual(image.type(self.dtype))
 
-    def encode_text(self, text):
+    def encode_text(self, text, trim: bool = False):
+        """Text features for a [batch_size, n_ctx] token batch.
+
+        `text` may be shorter than context_length as long as every EOT token
+        is kept. With `trim`, rows are grouped by length (`bucket_by_length`)
+        and each group runs only up to its own length; since attention is
+        causal, the EOT features come out the same as with full padding.
+        """
+        if trim:
+            return encode_bucketed(self.encode_text, text)
+
         x = self.token_embedding(text).type(self.dtype)  # [batch_size, n_ctx, d_model]
 
-        x = x + self.positional_embedding.type(self.dtype)
+        x = x + self.positional_embedding[:text.shape[1]].type(self.dtype)
         x = x.permute(1, 0, 2)  # NLD -> LND
         x = self.transformer(x)
         x = x.permute(1, 0, 2)  # LND -> NLD
@@ -382,31 +463,156 @@ class CLIP(nn.Module):
         # return image_features, text_features, self.logit_scale.exp()
 
 
-def convert_weights(model: nn.Module):
-    """Convert applicable model parameters to fp16"""
+def bucket_by_length(text: torch.Tensor, multiple: int = 8):
+    """Split a padded token batch into groups of similar length.
+
+    Yields (row indices, those rows cut to the group's length). A row's
+    length is its EOT position + 1 (EOT has the highest token id), rounded up
+    to `multiple` so at most context_length / multiple distinct shapes occur.
+    """
+    lengths = text.argmax(dim=-1) + 1
+    buckets = ((lengths + multiple - 1) // multiple * multiple).clamp(max=text.shape[1])
+    for length in buckets.unique().tolist():
+        rows = (buckets == length).nonzero().flatten()
+        yield rows, text[rows, :length]
+
+
+def encode_bucketed(encode, text: torch.Tensor):
+    """Call `encode` on each `bucket_by_length` group of `text`; rows come back in input order."""
+    features = None
+    for rows, tokens in bucket_by_length(text):
+        bucket = encode(tokens)
+        if features is None:
+            features = bucket.new_empty(text.shape[0], bucket.shape[1])
+        features[rows] = bucket
+    return features
+
 
-    def _convert_weights_to_fp16(l):
+def convert_weights(model: nn.Module, dtype: torch.dtype = torch.float16):
+    """Convert applicable model parameters to `dtype` (fp16 by default)
+
+    LayerNorms, embeddings and logit_scale stay fp32; see `LayerNorm` and
+    `CLIP.encode_text` for how activations are cast around them.
+    """
+
+    def _convert_weights(l):
         if isinstance(l, (nn.Conv1d, nn.Conv2d, nn.Linear)):
-            l.weight.data = l.weight.data.half()
+            l.weight.data = l.weight.data.to(dtype)
             if l.bias is not None:
-                l.bias.data = l.bias.data.half()
+                l.bias.data = l.bias.data.to(dtype)
 
         if isinstance(l, nn.MultiheadAttention):
             for attr in [*[f"{s}_proj_weight" for s in ["in", "q", "k", "v"]], "in_proj_bias", "bias_k", "bias_v"]:
                 tensor = getattr(l, attr)
                 if tensor is not None:
-                    tensor.data = tensor.data.half()
+                    tensor.data = tensor.data.to(dtype)
 
         for name in ["text_projection", "proj"]:
             if hasattr(l, name):
                 attr = getattr(l, name)
                 if attr is not None:
-                    attr.data = attr.data.half()
+                    attr.data = attr.data.to(dtype)
 
-    model.apply(_convert_weights_to_fp16)
+    model.apply(_convert_weights)
 
 
-def build_model(state_dict: dict):
+def _self_attention(qkv: torch.Tensor, num_heads: int, attn_mask: torch.Tensor = None, is_causal: bool = False):
+    """Fused attention over packed [length, batch, 3 * width] projections; returns [length, batch, width]."""
+    length, batch, width = qkv.shape[0], qkv.shape[1], qkv.shape[2] // 3
+    q, k, v = qkv.reshape(length, batch, 3, num_heads, width // num_heads).permute(2, 1, 3, 0, 4).unbind(0)
+    x = F.scaled_dot_product_attention(q, k, v, attn_mask=attn_mask, is_causal=is_causal)
+    return x.permute(2, 0, 1, 3).reshape(length, batch, width)
+
+
+class FusedMultiheadAttention(nn.MultiheadAttention):
+    """nn.MultiheadAttention computed with one fused scaled_dot_product_attention call.
+
+    Same parameters and state-dict keys (`in_proj_weight`, `in_proj_bias`,
+    `out_proj`) as the module it replaces; see `use_fused_attention`. With
+    `is_causal=True` no mask tensor is needed at all.
+    """
+
+    def forward(self, query: torch.Tensor, key: torch.Tensor, value: torch.Tensor,
+                need_weights: bool = False, attn_mask: torch.Tensor = None, is_causal: bool = False):
+        # Only ever called as self-attention (query is key is value), like MHA in ResidualAttentionBlock.
+        qkv = F.linear(query, self.in_proj_weight, self.in_proj_bias)
+        x = _self_attention(qkv, self.num_heads, attn_mask, is_causal and attn_mask is None)
+        return self.out_proj(x), None
+
+
+def use_fused_attention(model: nn.Module):
+    """Switch every ResidualAttentionBlock to FusedMultiheadAttention, in place.
+
+    Parameters are moved over, not copied, so this works on loaded models and
+    on meta-device skeletons alike. Blocks masked with CLIP's causal text mask
+    use `is_causal` instead of the 77x77 mask.
+    """
+    for block in model.modules():
+        if not isinstance(block, ResidualAttentionBlock) or type(block.attn) is not nn.MultiheadAttention:
+            continue
+        attn = block.attn
+        with torch.device("meta"):
+            fused = FusedMultiheadAttention(attn.embed_dim, attn.num_heads)
+        fused.in_proj_weight = attn.in_proj_weight
+        fused.in_proj_bias = attn.in_proj_bias
+        fused.out_proj = attn.out_proj
+        block.attn = fused.train(attn.training)
+
+        if block.attn_mask is not None:
+            length = block.attn_mask.shape[0]
+            causal = torch.full((length, length), float("-inf")).triu_(1)
+            block.is_causal = torch.equal(block.attn_mask.detach().float().cpu(), causal)
+    return model
+
+
+class ProjectedAttention(nn.Module):
+    """Self-attention with the input and output projections as plain Linear layers.
+
+    Computes the same thing as the `nn.MultiheadAttention` it replaces (see
+    `from_multihead`), but its projections can be swapped for quantized
+    Linear modules, which the fused MHA weights cannot.
+    """
+
+    def __init__(self, embed_dim: int, num_heads: int):
+        super().__init__()
+        self.num_heads = num_heads
+        self.in_proj = nn.Linear(embed_dim, 3 * embed_dim)
+        self.out_proj = nn.Linear(embed_dim, embed_dim)
+
+    @classmethod
+    def from_multihead(cls, attn: nn.MultiheadAttention):
+        module = cls(attn.embed_dim, attn.num_heads)
+        module.in_proj.weight = attn.in_proj_weight
+        module.in_proj.bias = attn.in_proj_bias
+        module.out_proj.weight = attn.out_proj.weight
+        module.out_proj.bias = attn.out_proj.bias
+        return module
+
+    def forward(self, query: torch.Tensor, key: torch.Tensor, value: torch.Tensor,
+                need_weights: bool = False, attn_mask: torch.Tensor = None, is_causal: bool = False):
+        # Only ever called as self-attention (query is key is value), like MHA in ResidualAttentionBlock.
+        x = _self_attention(self.in_proj(query), self.num_heads, attn_mask, is_causal and attn_mask is None)
+        return self.out_proj(x), None
+
+
+def quantize_dynamic(model: nn.Module):
+    """Convert the transformer Linear layers of an fp32 model to dynamic int8, in place.
+
+    Covers the MLP and attention projections of every ResidualAttentionBlock
+    (image and text towers); embeddings, convolutions, LayerNorms and the
+    final projections stay fp32. Weights are stored as int8 and activations
+    are quantized per call, so this only runs on CPU.
+    """
+    for block in model.modules():
+        if isinstance(block, ResidualAttentionBlock):
+            if isinstance(block.attn, nn.MultiheadAttention):
+                block.attn = ProjectedAttention.from_multihead(block.attn)
+            torch.ao.quantization.quantize_dynamic(block, {nn.Linear}, dtype=torch.qint8, inplace=True)
+    return model
+
+
+def model_config(state_dict: dict):
+    """Infer the CLIP constructor arguments from a state dict."""
     vit = "visual.proj" in state_dict
 
     if vit:
@@ -431,12 +637,41 @@ def build_model(state_dict: dict):
     transformer_heads = transformer_width // 64
     transformer_layers = len(set(k.split(".")[2] for k in state_dict if k.startswith(f"transformer.resblocks")))
 
-    model = CLIP(
-        embed_dim,
-        image_resolution, vision_layers, vision_width, vision_patch_size,
-        context_length, vocab_size, transformer_width, transformer_heads, transformer_layers
+    return dict(
+        embed_dim=embed_dim,
+        image_resolution=image_resolution,
+        vision_layers=vision_layers,
+        vision_width=vision_width,
+        vision_patch_size=vision_patch_size,
+        context_length=context_length,
+        vocab_size=vocab_size,
+        transformer_width=transformer_width,
+        transformer_heads=transformer_heads,
+        transformer_layers=transformer_layers,
     )
 
+
+def build_skeleton(config: dict, fused_attention: bool = False):
+    """Build a CLIP module whose parameters live on the meta device.
+
+    Nothing is allocated or initialized; weights are expected to be supplied
+    with `load_state_dict(..., assign=True)`. `fused_attention` applies
+    `use_fused_attention`, which leaves the state-dict keys unchanged.
+    """
+    with torch.device("meta"):
+        model = CLIP(**config)
+
+    # The causal mask is a plain attribute rather than a parameter, so it
+    # has to be materialized here instead of coming from the state dict.
+    attn_mask = model.build_attention_mask()
+    for block in model.transformer.resblocks:
+        block.attn_mask = attn_mask
+    return use_fused_attention(model) if fused_attention else model
+
+
+def build_model(state_dict: dict):
+    model = CLIP(**model_config(state_dict))
+
     for key in ["input_resolution", "context_length", "vocab_size"]:
         if key in state_dict:
             del state_dict[key]
@@ -1,6 +1,8 @@
 import gzip
+import hashlib
 import html
 import os
+import pickle
 from functools import lru_cache
 
 import ftfy
@@ -47,7 +49,14 @@ def get_pairs(word):
     return pairs
 
 
+# Printable ASCII (plus tabs/newlines) without '&': nothing for ftfy to fix
+# and no HTML entities to unescape.
+_PLAIN_TEXT = re.compile(r"[\t\n\r\x20-\x25\x27-\x7e]*")
+
+
 def basic_clean(text):
+    if _PLAIN_TEXT.fullmatch(text):
+        return text.strip()
     text = ftfy.fix_text(text)
     text = html.unescape(html.unescape(text))
     return text.strip()
@@ -59,25 +68,59 @@ def whitespace_clean(text):
     return text
 
 
+# Where the encoder/bpe_ranks tables parsed from the vocab file are cached.
+TOKENIZER_CACHE_DIR = os.environ.get("CLIP_TOKENIZER_CACHE", os.path.expanduser("~/.cache/clip"))
+
+
+def build_tables(bpe_path, special_tokens):
+    """(encoder, bpe_ranks) parsed from the gzipped merges file."""
+    merges = gzip.open(bpe_path).read().decode("utf-8").split('\n')
+    merges = merges[1:49152-256-2+1]
+    merges = [tuple(merge.split()) for merge in merges]
+    vocab = list(bytes_to_unicode().values())
+    vocab = vocab + [v+'</w>' for v in vocab]
+    for merge in merges:
+        vocab.append(''.join(merge))
+    vocab.extend(special_tokens)
+    return dict(zip(vocab, range(len(vocab)))), dict(zip(merges, range(len(merges))))
+
+
+def load_tables(bpe_path, special_tokens, cache_dir=TOKENIZER_CACHE_DIR):
+    """build_tables(), read from a pickle in cache_dir when one exists for this
+    vocab file and these special tokens. An unwritable cache_dir only costs the
+    parse."""
+    stat = os.stat(bpe_path)
+    key = hashlib.sha1(repr((os.path.basename(bpe_path), stat.st_size, stat.st_mtime_ns,
+                             special_tokens)).encode("utf-8")).hexdigest()[:16]
+    cache_path = os.path.join(cache_dir, f"bpe-{key}.pkl")
+    try:
+        with open(cache_path, "rb") as f:
+            return pickle.load(f)
+    except (OSError, pickle.UnpicklingError, EOFError):
+        pass
+
+    tables = build_tables(bpe_path, special_tokens)
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp_path = f"{cache_path}.tmp{os.getpid()}"
+        with open(tmp_path, "wb") as f:
+            pickle.dump(tables, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, cache_path)
+    except OSError:
+        pass
+    return tables
+
+
 class SimpleTokenizer(object):
     def __init__(self, bpe_path: str = default_bpe(), special_tokens=None):
         self.byte_encoder = bytes_to_unicode()
         self.byte_decoder = {v: k for k, v in self.byte_encoder.items()}
-        merges = gzip.open(bpe_path).read().decode("utf-8").split('\n')
-        merges = merges[1:49152-256-2+1]
-        merges = [tuple(merge.split()) for merge in merges]
-        vocab = list(bytes_to_unicode().values())
-        vocab = vocab + [v+'</w>' for v in vocab]
-        for merge in merges:
-            vocab.append(''.join(merge))
         if not special_tokens:
             special_tokens = ['<start_of_text>', '<end_of_text>']
         else:
             special_tokens = ['<start_of_text>', '<end_of_text>'] + special_tokens
-        vocab.extend(special_tokens)
-        self.encoder = dict(zip(vocab, range(len(vocab))))
+        self.encoder, self.bpe_ranks = load_tables(bpe_path, special_tokens)
         self.decoder = {v: k for k, v in self.encoder.items()}
-        self.bpe_ranks = dict(zip(merges, range(len(merges))))
         self.cache = {t:t for t in special_tokens}
         special = "|".join(special_tokens)
         self.pat = re.compile(special + r"""|'s|'t|'re|'ve|'m|'ll|'d|[\p{L}]+|[\p{N}]|[^\s\p{L}\p{N}]+""", re.IGNORECASE)
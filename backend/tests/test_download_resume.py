@@ -0,0 +1,89 @@
+"""download_file against a local stand-in for the HF resolve endpoint."""
+import hashlib
+import os
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import backend as B
+
+CHUNK = 1024 * 1024
+
+
+class _RangeHandler(BaseHTTPRequestHandler):
+    """Serves `self.server.blob`, honouring single byte ranges, and records
+    the first byte of every GET."""
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        blob = self.server.blob
+        start, end = 0, len(blob) - 1
+        header = self.headers.get("Range")
+        if header:
+            first, last = header.split("=")[1].split("-")
+            start, end = int(first), int(last) if last else len(blob) - 1
+        self.server.starts.append(start)
+        self.send_response(206 if header else 200)
+        if header:
+            self.send_header("Content-Range", f"bytes {start}-{end}/{len(blob)}")
+        self.send_header("Content-Length", str(end - start + 1))
+        self.end_headers()
+        self.wfile.write(blob[start:end + 1])
+
+
+@pytest.fixture
+def server():
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), _RangeHandler)
+    httpd.blob = os.urandom(5 * CHUNK + 12345)
+    httpd.starts = []
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield httpd
+    httpd.shutdown()
+
+
+def test_truncated_file_resumes_across_chunks(server, tmp_path, monkeypatch):
+    monkeypatch.setattr(B, "DOWNLOAD_CHUNK_BYTES", CHUNK)
+    monkeypatch.setattr(B, "DOWNLOAD_RANGES", 4)
+    blob = server.blob
+    local_path = str(tmp_path / "dtd.pth")
+    prefix = 2 * CHUNK + CHUNK // 2
+    with open(local_path, "wb") as f:
+        f.write(blob[:prefix])
+
+    # What download_models_if_missing does with a file cut short on disk.
+    B._discard_bad_copy(local_path, len(blob))
+    entry = {"name": "dtd.pth", "done": 0, "total": 0, "completed": False}
+    url = f"http://127.0.0.1:{server.server_address[1]}/models/dtd.pth"
+    B.download_file(url, local_path, len(blob), entry, hashlib.sha256(blob).hexdigest())
+
+    with open(local_path, "rb") as f:
+        assert f.read() == blob
+    assert min(server.starts) == prefix
+    assert sorted(server.starts) == [prefix, 3 * CHUNK, 4 * CHUNK, 5 * CHUNK]
+    assert not os.path.exists(local_path + ".part")
+    assert not os.path.exists(local_path + ".part.json")
+
+
+def test_part_without_state_is_not_trusted(server, tmp_path, monkeypatch):
+    monkeypatch.setattr(B, "DOWNLOAD_CHUNK_BYTES", CHUNK)
+    monkeypatch.setattr(B, "DOWNLOAD_RANGES", 4)
+    blob = server.blob
+    local_path = str(tmp_path / "dtd.pth")
+    # An earlier attempt extended the .part to full size, then lost its state.
+    with open(local_path + ".part", "wb") as f:
+        f.write(blob[:CHUNK])
+        f.truncate(len(blob))
+
+    entry = {"name": "dtd.pth", "done": 0, "total": 0, "completed": False}
+    url = f"http://127.0.0.1:{server.server_address[1]}/models/dtd.pth"
+    B.download_file(url, local_path, len(blob), entry)
+
+    with open(local_path, "rb") as f:
+        assert f.read() == blob
+    assert min(server.starts) == 0
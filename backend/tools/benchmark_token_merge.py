@@ -0,0 +1,114 @@
+"""Latency and top-1 agreement of /predict?token_merge=... against full inference.
+
+    python tools/benchmark_token_merge.py [--models zscl/dtd.pth ...] [--ratios 0.05 0.1 0.2 0.3] [--json report.json]
+
+Every checkpoint (default: all downloaded ones, plus the base model) encodes
+each image under test_images/<dataset>/ one at a time, as /predict does,
+once at full resolution and once per merge ratio. Images are classified
+against classes/<dataset>.txt with the backend's default prompt, and per
+model and ratio the report gives:
+
+- image-encoder time per image, and the speedup over full resolution
+- top-1 agreement with full-resolution inference
+- top-1 accuracy, for images whose file name names their class
+- lowest cosine similarity to the full-resolution image features
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import backend as B
+import clip
+from eval_utils import add_model_arguments, load_datasets, select_models
+
+
+def run(model, datasets, ratio, torch):
+    """Top-1 predictions, image features and encoder seconds per dataset."""
+    outputs = {}
+    with torch.no_grad():
+        for dataset, names, images in datasets:
+            prompts = [f"{B.DEFAULT_PROMPT_PRE} {n}" for n in names]
+            text = model.encode_text(clip.tokenize(prompts).to(B.device)).float()
+            text = text / text.norm(dim=-1, keepdim=True)
+            features, seconds = [], 0.0
+            for path, _ in images:
+                pixels = B.pre_process(B.Image.open(path)).unsqueeze(0).to(B.device, model.dtype)
+                start = time.perf_counter()
+                features.append(model.encode_image(pixels, ratio).float())
+                seconds += time.perf_counter() - start
+            features = torch.cat(features)
+            features = features / features.norm(dim=-1, keepdim=True)
+            outputs[dataset] = ((features @ text.t()).argmax(dim=-1), features, seconds)
+    return outputs
+
+
+def compare(name, ratio, full, merged, datasets, torch):
+    total = agree = labelled = correct = 0
+    min_cos = 1.0
+    full_seconds = merged_seconds = 0.0
+    for dataset, _, images in datasets:
+        top_full, f_full, s_full = full[dataset]
+        top, f, s = merged[dataset]
+        total += len(images)
+        agree += int((top == top_full).sum())
+        min_cos = min(min_cos, float(torch.nn.functional.cosine_similarity(f_full, f).min()))
+        full_seconds += s_full
+        merged_seconds += s
+        for i, (_, label) in enumerate(images):
+            if label is not None:
+                labelled += 1
+                correct += int(top[i] == label)
+    return {
+        "model": name,
+        "token_merge": ratio,
+        "images": total,
+        "ms_per_image": 1000 * merged_seconds / total,
+        "speedup": full_seconds / merged_seconds,
+        "top1_agreement": agree / total,
+        "labelled_images": labelled,
+        "top1": correct / labelled if labelled else None,
+        "min_feature_cosine": min_cos,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    add_model_arguments(parser)
+    parser.add_argument("--ratios", nargs="+", type=float, default=[0.05, 0.1, 0.2, 0.3],
+                        help="token_merge values to compare, each in (0, 1)")
+    parser.add_argument("--json", help="also write the report to this file")
+    args = parser.parse_args()
+    if any(not 0 < r < 1 for r in args.ratios):
+        parser.error("--ratios must be between 0 and 1")
+
+    B.initialize_backend()
+    torch = B.torch
+    datasets = load_datasets()
+
+    report = []
+    for name, model_key in select_models(args):
+        print(f"Evaluating {name}...")
+        # Served the way /predict would serve it: same precision and quantization.
+        model = B.get_base_model() if model_key == B.BASE_MODEL_KEY else B.load_model(model_key)
+        full = run(model, datasets, 0.0, torch)
+        for ratio in args.ratios:
+            report.append(compare(name, ratio, full, run(model, datasets, ratio, torch), datasets, torch))
+        del model
+
+    print()
+    print(f"{'model':<28} {'ratio':>6} {'ms':>7} {'speedup':>8} {'agree':>6} {'top1':>6} {'cos':>7}")
+    for r in report:
+        top1 = f"{r['top1']:6.3f}" if r["top1"] is not None else f"{'-':>6}"
+        print(f"{r['model']:<28} {r['token_merge']:6.2f} {r['ms_per_image']:7.1f} {r['speedup']:7.2f}x "
+              f"{r['top1_agreement']:6.3f} {top1} {r['min_feature_cosine']:7.4f}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
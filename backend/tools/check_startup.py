@@ -0,0 +1,88 @@
+"""Guard the torch-free startup path with a `python -X importtime` profile.
+
+    python tools/check_startup.py [--budget-ms 2000] [--top 10]
+
+Imports backend in a fresh interpreter and calls the endpoints that must
+answer before initialize_backend() runs (class lists, t-SNE listings,
+download progress, cache stats). Fails if any of them pulled in torch or
+another heavy module, or if the imports took longer than --budget-ms, and
+prints the slowest imports either way.
+"""
+import argparse
+import os
+import subprocess
+import sys
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Only initialize_backend() (or the first model request) may import these.
+HEAVY_MODULES = ["torch", "torchvision", "tqdm", "ftfy", "regex", "onnxruntime",
+                 "clip.clip", "clip.model", "clip.tokenizer"]
+
+PROBE = f"""
+import sys
+import backend as B
+
+session = B.get_session(B.DEFAULT_SESSION)
+B.getClassNames(session)
+B.getPrompt(session)
+B.getTsneCsvMethods()
+B.getTsneCsv3dMethods()
+B.get_download_progress()
+B.get_cache_stats()
+B.get_device()
+
+loaded = [m for m in {HEAVY_MODULES!r} if m in sys.modules]
+print("HEAVY " + " ".join(loaded), file=sys.stderr)
+"""
+
+
+def parse_importtime(stderr):
+    """[(cumulative microseconds, nesting depth, module)] per import, and HEAVY modules."""
+    imports, heavy = [], []
+    for line in stderr.splitlines():
+        if line.startswith("import time:") and "|" in line:
+            _, cumulative, name = line[len("import time:"):].split("|")
+            if cumulative.strip().isdigit():
+                depth = (len(name) - len(name.lstrip()) - 1) // 2
+                imports.append((int(cumulative), depth, name.strip()))
+        elif line.startswith("HEAVY"):
+            heavy = line.split()[1:]
+    return imports, heavy
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--budget-ms", type=float, default=2000,
+                        help="maximum total import time of backend and its dependencies")
+    parser.add_argument("--top", type=int, default=10, help="number of slowest imports to print")
+    args = parser.parse_args()
+
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", PROBE],
+                          cwd=BACKEND_DIR, capture_output=True, text=True)
+    if proc.returncode != 0:
+        print(proc.stderr[-4000:])
+        print("FAILED: torch-free endpoints raised")
+        sys.exit(1)
+
+    imports, heavy = parse_importtime(proc.stderr)
+    total_ms = sum(us for us, depth, _ in imports if depth == 0) / 1000
+    print(f"{'ms':>8}  module")
+    for us, _, name in sorted(i for i in imports if i[1] == 1)[::-1][:args.top]:
+        print(f"{us / 1000:8.1f}  {name}")
+    print(f"{total_ms:8.1f}  total")
+
+    failed = False
+    if heavy:
+        print(f"FAILED: startup imported {', '.join(heavy)}")
+        failed = True
+    if total_ms > args.budget_ms:
+        print(f"FAILED: imports took {total_ms:.0f} ms (> {args.budget_ms:.0f} ms)")
+        failed = True
+    if failed:
+        sys.exit(1)
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+"""Convert checkpoints in models/ to safetensors for faster, pickle-free loads.
+
+    python tools/convert_safetensors.py [--models zscl/dtd.pth ...] [--no-base] [--force]
+
+Each <name>.pth is written next to itself as <name>.safetensors, holding the
+state dict with any "module." prefix removed; the base ViT-B/16 JIT archive
+becomes models/ViT-B-16.safetensors. The header metadata records the
+method, dataset, architecture and source file. The backend reads the
+.safetensors file instead of the .pth (under the same model name) whenever
+it is at least as new, so re-downloading a .pth makes it fall back until the
+conversion is re-run. Needs the safetensors package.
+"""
+import argparse
+import os
+import sys
+
+# Conversion runs on the CPU.
+os.environ.setdefault("CUDA_VISIBLE_DEVICES", "")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import backend as B
+import torch
+from safetensors.torch import save_file
+from eval_utils import add_model_arguments, select_models
+
+
+def write(state_dict, path, metadata):
+    # safetensors refuses tensors that share storage; give each its own.
+    tensors = {name: t.detach().contiguous().clone() for name, t in state_dict.items()}
+    save_file(tensors, path + ".tmp", metadata=metadata)
+    os.replace(path + ".tmp", path)
+    B.check_checkpoint_shapes(path)
+    print(f"  wrote {path} ({os.path.getsize(path) / 2**20:.1f} MB, {len(tensors)} tensors)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    add_model_arguments(parser)
+    parser.add_argument("--force", action="store_true", help="re-convert files that are already up to date")
+    args = parser.parse_args()
+
+    B.initialize_backend()
+    architecture = B.BASE_MODEL_KEY
+
+    for rel, model_path in select_models(args):
+        if model_path == B.BASE_MODEL_KEY:
+            path = B._artifact_prefix(B.BASE_MODEL_KEY) + ".safetensors"
+            if os.path.isfile(path) and not args.force:
+                print(f"{B.BASE_MODEL_KEY}: up to date")
+            else:
+                print(f"Converting {B.BASE_MODEL_KEY}...")
+                write(B.get_base_model().state_dict(), path,
+                      {"method": "base", "dataset": "base", "architecture": architecture, "source": architecture})
+            continue
+        if not model_path.endswith(".pth"):
+            continue
+        path = os.path.splitext(model_path)[0] + ".safetensors"
+        if os.path.isfile(path) and os.path.getmtime(path) >= os.path.getmtime(model_path) and not args.force:
+            print(f"{model_path}: up to date")
+            continue
+
+        print(f"Converting {model_path}...")
+        method = rel.split("/")[0] if "/" in rel else "base"
+        state_dict = torch.load(model_path, map_location="cpu")["state_dict"]
+        state_dict = {name[len("module."):] if name.startswith("module.") else name: t
+                      for name, t in state_dict.items()}
+        write(state_dict, path, {
+            "method": method,
+            "dataset": os.path.splitext(os.path.basename(model_path))[0],
+            "architecture": architecture,
+            "source": rel,
+        })
+        del state_dict
+
+
+if __name__ == "__main__":
+    main()
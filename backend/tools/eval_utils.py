@@ -0,0 +1,60 @@
+"""Helpers shared by the evaluation scripts in this folder."""
+import os
+import re
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import backend as B
+
+TEST_IMAGES_DIR = os.path.join(B.BASE_DIR, "test_images")
+CLASS_FILES = {"imagenet": "imagenet_classes.txt"}
+
+
+def _normalize(name):
+    return re.sub(r"[^a-z0-9]", "", name.lower())
+
+
+def add_model_arguments(parser, base=True):
+    """--models, and --no-base unless the tool always covers the base model."""
+    parser.add_argument("--models", nargs="*", help="checkpoint paths relative to models/ (default: all downloaded)")
+    if base:
+        parser.add_argument("--no-base", action="store_true", help="skip the base CLIP model")
+
+
+def select_models(args):
+    """[(name, model key)] for the parsed --models/--no-base, base model first.
+
+    Without --models every downloaded checkpoint is used; checkpoints that are
+    not downloaded yet are only used on request, and are fetched here."""
+    targets = [] if getattr(args, "no_base", False) else [(B.BASE_MODEL_KEY, B.BASE_MODEL_KEY)]
+    models_dir = os.path.join(B.BASE_DIR, "models")
+    if args.models:
+        paths = [os.path.join(models_dir, *rel.split("/")) for rel in args.models]
+    else:
+        paths = [p for p in B.model_paths if not B.model_meta[p]["remote"]]
+    for path in paths:
+        if B._is_remote(path):
+            print(f"Downloading {path}...")
+            B.request_checkpoint(path, urgent=True).result()
+        targets.append((os.path.relpath(path, models_dir).replace(os.sep, "/"), path))
+    return targets
+
+
+def load_datasets():
+    """[(dataset, class names, [(image path, label index or None)])] for test_images."""
+    datasets = []
+    for dataset in sorted(os.listdir(TEST_IMAGES_DIR)):
+        folder = os.path.join(TEST_IMAGES_DIR, dataset)
+        class_file = os.path.join(B.BASE_DIR, "classes", CLASS_FILES.get(dataset, f"{dataset}.txt"))
+        if not os.path.isdir(folder) or not os.path.isfile(class_file):
+            continue
+        with open(class_file, encoding="utf-8") as f:
+            names = [l.strip() for l in f.read().splitlines() if l.strip()]
+        lookup = {_normalize(n): i for i, n in enumerate(names)}
+        images = []
+        for filename in sorted(os.listdir(folder)):
+            if filename.lower().endswith(B.IMAGE_EXTENSIONS):
+                stem = re.sub(r"_\d+$", "", os.path.splitext(filename)[0])
+                images.append((os.path.join(folder, filename), lookup.get(_normalize(stem))))
+        datasets.append((dataset, names, images))
+    return datasets
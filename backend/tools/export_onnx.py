@@ -0,0 +1,115 @@
+"""Export checkpoint image/text encoders to ONNX for INFERENCE_BACKEND=onnx.
+
+    python tools/export_onnx.py [--models zscl/dtd.pth ...] [--no-base] [--opset 17] [--force]
+
+Graphs are written next to each checkpoint as <name>.image.onnx and
+<name>.text.onnx (models/ViT-B-16.* for the base model), plus a
+<name>.onnx.json manifest tying them to the checkpoint file, so a
+re-downloaded checkpoint is never served by a stale graph. Both graphs take
+one input named "input" (pixels [N, 3, R, R] float32 / token ids [N, L]
+int64, L <= 77 so TRIM_TEXT buckets work) with a dynamic batch axis and
+return unnormalized "features".
+
+Exports are fp32. When onnxruntime is installed every graph is checked
+against the torch encoder before its manifest is written.
+"""
+import argparse
+import json
+import os
+import sys
+
+# Exports are traced on CPU in fp32.
+os.environ.setdefault("CUDA_VISIBLE_DEVICES", "")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import backend as B
+import clip
+import torch
+from eval_utils import add_model_arguments, select_models
+
+try:
+    import onnxruntime
+except ImportError:
+    onnxruntime = None
+
+
+class Encoder(torch.nn.Module):
+    """One of a CLIP model's two encoders as a single-input module."""
+
+    def __init__(self, model, kind):
+        super().__init__()
+        self.model = model
+        self.kind = kind
+
+    def forward(self, x):
+        return self.model.encode_image(x) if self.kind == "image" else self.model.encode_text(x)
+
+
+def example_input(kind):
+    if kind == "image":
+        resolution = B._model_config["image_resolution"]
+        return torch.randn(2, 3, resolution, resolution)
+    return clip.tokenize(["a photo of a dog", "a photo of a striped cat"])
+
+
+def export(model_key, model, opset):
+    prefix = B._artifact_prefix(model_key)
+    for kind in ("image", "text"):
+        graph_path = f"{prefix}.{kind}.onnx"
+        example = example_input(kind)
+        torch.onnx.export(
+            Encoder(model, kind), (example,), graph_path + ".tmp",
+            input_names=["input"], output_names=["features"],
+            dynamic_axes={"input": {0: "batch", 1: "length"} if kind == "text" else {0: "batch"},
+                          "features": {0: "batch"}},
+            opset_version=opset, dynamo=False,
+        )
+        os.replace(graph_path + ".tmp", graph_path)
+
+        if onnxruntime is not None:
+            session = onnxruntime.InferenceSession(graph_path, providers=["CPUExecutionProvider"])
+            batch = torch.cat([example, example[:1]])  # a batch size the trace never saw
+            if kind == "text":
+                batch = batch[:, :16]  # and a trimmed length
+            with torch.no_grad():
+                expected = Encoder(model, kind)(batch)
+            got = torch.from_numpy(session.run(None, {"input": batch.numpy()})[0])
+            diff = (got - expected).abs().max().item()
+            print(f"  {kind}: max |onnx - torch| = {diff:.2e}")
+            if diff > 1e-3:
+                raise RuntimeError(f"{graph_path} does not match the torch {kind} encoder")
+
+    with open(prefix + ".onnx.json", "w", encoding="utf-8") as f:
+        json.dump(B.onnx_manifest(model_key), f)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    add_model_arguments(parser)
+    parser.add_argument("--opset", type=int, default=17)
+    parser.add_argument("--force", action="store_true", help="re-export graphs that are already up to date")
+    args = parser.parse_args()
+
+    B.initialize_backend()
+
+    for name, model_key in select_models(args):
+        prefix = B._artifact_prefix(model_key)
+        try:
+            with open(prefix + ".onnx.json", "r", encoding="utf-8") as f:
+                current = json.load(f) == B.onnx_manifest(model_key)
+        except (OSError, ValueError):
+            current = False
+        if current and not args.force:
+            print(f"{name}: up to date")
+            continue
+
+        print(f"Exporting {name}...")
+        # Always fp32 and unquantized, whatever the serving settings are.
+        model = B.get_base_model() if model_key == B.BASE_MODEL_KEY else \
+            B.materialize_model(B.read_checkpoint(model_key))
+        export(model_key, model, args.opset)
+        del model
+
+
+if __name__ == "__main__":
+    main()
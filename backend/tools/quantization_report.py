@@ -0,0 +1,126 @@
+"""Accuracy delta of QUANTIZATION=int8 against fp32 on backend/test_images.
+
+    python tools/quantization_report.py [--models zscl/dtd.pth ...] [--json report.json]
+
+Every checkpoint (default: all downloaded ones, plus the base model) is
+loaded once in fp32 and once quantized. Each image under test_images/<dataset>/
+is classified against classes/<dataset>.txt with the backend's default prompt,
+and per model the report gives:
+
+- top-1 agreement between fp32 and int8
+- top-1 accuracy of both, for images whose file name names their class
+- mean absolute difference of the class probabilities
+- lowest cosine similarity between fp32 and int8 image features
+- image-encoder time per image, and total parameter bytes
+"""
+import argparse
+import copy
+import json
+import os
+import sys
+import time
+
+# Dynamic int8 kernels only exist on CPU.
+os.environ.setdefault("CUDA_VISIBLE_DEVICES", "")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import backend as B
+import clip
+from eval_utils import add_model_arguments, load_datasets, select_models
+
+
+def run(model, datasets, torch):
+    """Class probabilities, image features and encoder seconds per dataset."""
+    outputs = {}
+    with torch.no_grad():
+        for dataset, names, images in datasets:
+            prompts = [f"{B.DEFAULT_PROMPT_PRE} {n}" for n in names]
+            text = model.encode_text(clip.tokenize(prompts).to(B.device))
+            text = text / text.norm(dim=-1, keepdim=True)
+            pixels = torch.cat([B.pre_process(B.Image.open(path)).unsqueeze(0) for path, _ in images]).to(B.device)
+            start = time.perf_counter()
+            features = model.encode_image(pixels)
+            seconds = time.perf_counter() - start
+            features = features / features.norm(dim=-1, keepdim=True)
+            probs = (model.logit_scale.exp() * features @ text.t()).softmax(dim=-1)
+            outputs[dataset] = (probs, features, seconds)
+    return outputs
+
+
+def resident_bytes(model):
+    return sum(t.element_size() * t.nelement() for t in B._state_tensors(model))
+
+
+def compare(name, fp32, int8, fp32_bytes, int8_bytes, datasets, torch):
+    total = agree = labelled = fp32_correct = int8_correct = 0
+    prob_delta = 0.0
+    min_cos = 1.0
+    fp32_seconds = int8_seconds = 0.0
+    for dataset, _, images in datasets:
+        p32, f32, s32 = fp32[dataset]
+        p8, f8, s8 = int8[dataset]
+        top32, top8 = p32.argmax(dim=-1), p8.argmax(dim=-1)
+        total += len(images)
+        agree += int((top32 == top8).sum())
+        prob_delta += float((p32 - p8).abs().mean(dim=-1).sum())
+        min_cos = min(min_cos, float(torch.nn.functional.cosine_similarity(f32, f8.to(f32.dtype)).min()))
+        fp32_seconds += s32
+        int8_seconds += s8
+        for i, (_, label) in enumerate(images):
+            if label is not None:
+                labelled += 1
+                fp32_correct += int(top32[i] == label)
+                int8_correct += int(top8[i] == label)
+    return {
+        "model": name,
+        "images": total,
+        "top1_agreement": agree / total,
+        "labelled_images": labelled,
+        "fp32_top1": fp32_correct / labelled if labelled else None,
+        "int8_top1": int8_correct / labelled if labelled else None,
+        "mean_abs_prob_delta": prob_delta / total,
+        "min_feature_cosine": min_cos,
+        "fp32_ms_per_image": 1000 * fp32_seconds / total,
+        "int8_ms_per_image": 1000 * int8_seconds / total,
+        "fp32_bytes": fp32_bytes,
+        "int8_bytes": int8_bytes,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    add_model_arguments(parser)
+    parser.add_argument("--json", help="also write the report to this file")
+    args = parser.parse_args()
+
+    B.initialize_backend()
+    torch = B.torch
+    datasets = load_datasets()
+
+    report = []
+    for name, model_key in select_models(args):
+        print(f"Evaluating {name}...")
+        fp32_model = B.get_base_model() if model_key == B.BASE_MODEL_KEY else \
+            B.materialize_model(B.read_checkpoint(model_key))
+        int8_model = clip.model.quantize_dynamic(copy.deepcopy(fp32_model))
+        report.append(compare(name, run(fp32_model, datasets, torch), run(int8_model, datasets, torch),
+                              resident_bytes(fp32_model), resident_bytes(int8_model), datasets, torch))
+        del fp32_model, int8_model
+
+    print()
+    print(f"{'model':<28} {'agree':>6} {'fp32@1':>7} {'int8@1':>7} {'|dp|':>8} {'cos':>7} "
+          f"{'fp32 ms':>8} {'int8 ms':>8} {'fp32 MB':>8} {'int8 MB':>8}")
+    for r in report:
+        acc = lambda v: f"{v:7.3f}" if v is not None else f"{'-':>7}"
+        print(f"{r['model']:<28} {r['top1_agreement']:6.3f} {acc(r['fp32_top1'])} {acc(r['int8_top1'])} "
+              f"{r['mean_abs_prob_delta']:8.5f} {r['min_feature_cosine']:7.4f} "
+              f"{r['fp32_ms_per_image']:8.1f} {r['int8_ms_per_image']:8.1f} "
+              f"{r['fp32_bytes'] / 2**20:8.1f} {r['int8_bytes'] / 2**20:8.1f}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
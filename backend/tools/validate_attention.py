@@ -0,0 +1,86 @@
+"""Check FUSED_ATTENTION against nn.MultiheadAttention on real checkpoints.
+
+    python tools/validate_attention.py [--models zscl/dtd.pth ...] [--batch 8] [--tolerance 1e-4]
+
+For the base model and each checkpoint, both encoders run on the same inputs
+with the original nn.MultiheadAttention blocks and with
+clip.model.use_fused_attention applied. The script prints the largest
+absolute feature difference and the time per forward for each
+implementation. It exits non-zero if any difference exceeds --tolerance.
+"""
+import argparse
+import copy
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import backend as B
+import clip
+import torch
+from eval_utils import add_model_arguments, select_models
+
+
+def unfused(model):
+    """A copy of `model` with plain nn.MultiheadAttention in every block."""
+    model = copy.deepcopy(model)
+    for block in model.modules():
+        if isinstance(block, clip.model.ResidualAttentionBlock) and \
+                isinstance(block.attn, clip.model.FusedMultiheadAttention):
+            fused = block.attn
+            with torch.device("meta"):
+                attn = torch.nn.MultiheadAttention(fused.embed_dim, fused.num_heads)
+            attn.in_proj_weight = fused.in_proj_weight
+            attn.in_proj_bias = fused.in_proj_bias
+            attn.out_proj = fused.out_proj
+            block.attn = attn.eval()
+            block.is_causal = False
+    return model
+
+
+def timed(fn, x, repeats=3):
+    fn(x)
+    start = time.perf_counter()
+    for _ in range(repeats):
+        out = fn(x)
+    return out, 1000 * (time.perf_counter() - start) / repeats
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    add_model_arguments(parser, base=False)
+    parser.add_argument("--batch", type=int, default=8, help="images (and 8x this many prompts) per forward")
+    parser.add_argument("--tolerance", type=float, default=1e-4)
+    args = parser.parse_args()
+
+    B.initialize_backend()
+    targets = select_models(args)
+
+    resolution = B._model_config["image_resolution"]
+    pixels = torch.randn(args.batch, 3, resolution, resolution, device=B.device)
+    names = (B.session_class_names(B.get_session(B.DEFAULT_SESSION)) * (8 * args.batch))[:8 * args.batch]
+    tokens = clip.tokenize([f"{B.DEFAULT_PROMPT_PRE} {n}" for n in names]).to(B.device)
+
+    worst = 0.0
+    print(f"{'model':<28} {'kind':<6} {'max |diff|':>11} {'mha ms':>8} {'fused ms':>9}")
+    for name, model_key in targets:
+        model = B.get_model(model_key)
+        fused = model if B.FUSED_ATTENTION else clip.model.use_fused_attention(copy.deepcopy(model))
+        reference = unfused(fused)
+        with torch.no_grad():
+            for kind, x in (("image", pixels), ("text", tokens)):
+                run = lambda m: (lambda inputs: m.encode_image(inputs) if kind == "image" else m.encode_text(inputs))
+                expected, mha_ms = timed(run(reference), x)
+                got, fused_ms = timed(run(fused), x)
+                diff = (got.float() - expected.float()).abs().max().item()
+                worst = max(worst, diff)
+                print(f"{name:<28} {kind:<6} {diff:11.2e} {mha_ms:8.1f} {fused_ms:9.1f}")
+
+    if worst > args.tolerance:
+        print(f"FAILED: fused attention differs by {worst:.2e} (> {args.tolerance:.0e})")
+        sys.exit(1)
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()
@@ -2,6 +2,7 @@
 import { useState, useCallback, useEffect } from "react";
 
 const API = import.meta.env.VITE_API_URL;
+import { apiFetch } from "../session";
 import { UploadImage } from "../components/UploadImage";
 import LoadingSpinner from "../components/LoadingSpinner";
 import ModelDownloadProgress from "../components/ModelDownloadProgress";
@@ -102,7 +103,7 @@ export default function Home({className}) {
         const poll = async () => {
             while (!stopped) {
                 try {
-                    const r = await fetch(`${API}/download-progress`);
+                    const r = await apiFetch(`${API}/download-progress`);
                     const data = await r.json();
                     setDownloadProgress(data);
                 } catch {}
@@ -111,7 +112,7 @@ export default function Home({className}) {
         };
         poll();
 
-        fetch(`${API}/getmodels`)
+        apiFetch(`${API}/getmodels`)
             .then(r => r.json())
             .then(data => {
                 setAvailableModels(data.models);
@@ -122,7 +123,7 @@ export default function Home({className}) {
                 stopped = true;
                 setIsLoadingModels(false);
                 setDownloadProgress(null);
-                fetch(`${API}/device`).then(r => r.json()).then(d => setBackendDevice(d.device)).catch(() => {});
+                apiFetch(`${API}/device`).then(r => r.json()).then(d => setBackendDevice(d.device)).catch(() => {});
             });
 
         return () => { stopped = true; };
@@ -131,7 +132,7 @@ export default function Home({className}) {
     const toggleDownloadPause = useCallback(async () => {
         const endpoint = downloadProgress?.paused ? "resume-downloads" : "pause-downloads";
         try {
-            const r = await fetch(`${API}/${endpoint}`, { method: "POST" });
+            const r = await apiFetch(`${API}/${endpoint}`, { method: "POST" });
             const data = await r.json();
             setDownloadProgress(prev => prev ? { ...prev, paused: data.paused } : prev);
         } catch {}
@@ -143,21 +144,21 @@ export default function Home({className}) {
         try {
             if (preview != null){
                 if (currentImageData != null){
-                    await fetch(`${API}/upload`, {
+                    await apiFetch(`${API}/upload`, {
                         method: "POST",
                         body: currentImageData,
                     });
                 }
 
                 const activeModelsArray = selectedModels.map(m => m ? 1 : 0);
-                await fetch(`${API}/setactivemodels?preload=${!lowMemMode}`, {
+                await apiFetch(`${API}/setactivemodels?preload=${!lowMemMode}`, {
                     method: "POST",
                     headers: { "Content-Type": "application/json" },
                     body: JSON.stringify(activeModelsArray)
                 });
 
                 setNoImageError(false);
-                const res = await fetch(
+                const res = await apiFetch(
                     lowMemMode ? `${API}/predict_lowmem` : `${API}/predict`,
                     { method: "GET" }
                 );
@@ -177,12 +178,12 @@ export default function Home({className}) {
 
     async function displayClasses(){
         setIsGettingClasses(true);
-        const res = await fetch(`${API}/getclassnames`, {
+        const res = await apiFetch(`${API}/getclassnames`, {
             method: "GET",
         });
         setClasses(await res.json());
         
-        const prompt_res = await fetch(`${API}/getprompt`, {
+        const prompt_res = await apiFetch(`${API}/getprompt`, {
             method: "GET",
         });
         
@@ -195,7 +196,7 @@ export default function Home({className}) {
 
     async function saveClasses(classes, prompt){
         const text = classes
-        const res = await fetch(`${API}/saveclassnames`, {
+        const res = await apiFetch(`${API}/saveclassnames`, {
             method: "POST",
             headers: {
                 "Content-Type": "application/json"
@@ -203,7 +204,7 @@ export default function Home({className}) {
             body: JSON.stringify({text})
         })
 
-        const res_prompt = await fetch(`${API}/saveprompt`, {
+        const res_prompt = await apiFetch(`${API}/saveprompt`, {
             method: "POST",
             headers: {
                 "Content-Type": "application/json"
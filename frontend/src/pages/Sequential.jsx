@@ -2,6 +2,7 @@
 import { useState, useCallback } from "react";
 
 const API = import.meta.env.VITE_API_URL;
+import { apiFetch } from "../session";
 import { UploadImage } from "../components/UploadImage";
 import LoadingSpinner from "../components/LoadingSpinner";
 import { ClassTextArea } from "../components/ClassTextArea";
@@ -68,14 +69,14 @@ export default function Sequential({ className }) {
 
         if (preview != null) {
             if (currentImageData != null) {
-                await fetch(`${API}/upload`, {
+                await apiFetch(`${API}/upload`, {
                     method: "POST",
                     body: currentImageData,
                 });
             }
 
             // Send all selected models to backend
-            await fetch(`${API}/setsequentialmodels`, {
+            const selection = await (await apiFetch(`${API}/setsequentialmodels`, {
                 method: "POST",
                 headers: {
                     "Content-Type": "application/json"
@@ -83,9 +84,21 @@ export default function Sequential({ className }) {
                 body: JSON.stringify({
                     models: selectedModels
                 })
-            });
+            })).json();
+            if (selection.error) {
+                setResults(selection);
+                setIsPredicting(false);
+                return;
+            }
 
-            const res = await fetch(`${API}/predictsequential`, {
+            // Checkpoints load in the background; wait so failures show up per model.
+            while (selection.job_id) {
+                const status = await (await apiFetch(`${API}/load-status?job_id=${selection.job_id}`)).json();
+                if (status.error || status.done) break;
+                await new Promise(resolve => setTimeout(resolve, 500));
+            }
+
+            const res = await apiFetch(`${API}/predictsequential`, {
                 method: "GET",
             });
 
@@ -105,12 +118,12 @@ export default function Sequential({ className }) {
 
     async function displayClasses() {
         setIsGettingClasses(true);
-        const res = await fetch(`${API}/getclassnames`, {
+        const res = await apiFetch(`${API}/getclassnames`, {
             method: "GET",
         });
         setClasses(await res.json());
 
-        const prompt_res = await fetch(`${API}/getprompt`, {
+        const prompt_res = await apiFetch(`${API}/getprompt`, {
             method: "GET",
         });
 
@@ -122,7 +135,7 @@ export default function Sequential({ className }) {
 
     async function saveClasses(classes, prompt) {
         const text = classes;
-        const res = await fetch(`${API}/saveclassnames`, {
+        const res = await apiFetch(`${API}/saveclassnames`, {
             method: "POST",
             headers: {
                 "Content-Type": "application/json"
@@ -130,7 +143,7 @@ export default function Sequential({ className }) {
             body: JSON.stringify({ text })
         });
 
-        const res_prompt = await fetch(`${API}/saveprompt`, {
+        const res_prompt = await apiFetch(`${API}/saveprompt`, {
             method: "POST",
             headers: {
                 "Content-Type": "application/json"
@@ -420,6 +433,23 @@ export default function Sequential({ className }) {
                         </div>
                         <div className="flex flex-row gap-6 overflow-x-auto pb-4">
                             {Object.entries(results).map(([modelName, modelResults], index) => {
+                                if (modelResults && modelResults.error) {
+                                    return (
+                                        <div key={modelName} className="flex flex-col gap-2 min-w-[280px] flex-1 bg-white/5 rounded-lg p-4">
+                                            <div className="flex items-center gap-2 border-b border-[var(--color-honeydew)]/30 pb-2 flex-wrap">
+                                                <span className="bg-[var(--color-magenta)]/60 text-xs px-2 py-1 rounded">
+                                                    #{index + 1}
+                                                </span>
+                                                <span className="text-lg font-semibold truncate flex-1" title={modelName}>
+                                                    {modelName}
+                                                </span>
+                                            </div>
+                                            <div className="text-red-400 bg-red-950/40 border border-red-700/40 rounded-md px-3 py-2 text-sm">
+                                                Failed to run this checkpoint — it may be corrupted. {modelResults.error}
+                                            </div>
+                                        </div>
+                                    );
+                                }
                                 const allEntries = Object.entries(modelResults);
                                 const correctLabel = findCorrectLabel(modelResults, correctClass);
                                 const correctRank = correctLabel
@@ -0,0 +1,22 @@
+// Each browser tab gets its own backend session (upload, prompt, class list,
+// model selection) so tabs no longer overwrite each other's state.
+const SESSION_KEY = "sessionId";
+
+function newSessionId() {
+    if (window.crypto?.randomUUID) return window.crypto.randomUUID();
+    return Array.from({ length: 32 }, () => Math.floor(Math.random() * 16).toString(16)).join("");
+}
+
+export function sessionId() {
+    let id = sessionStorage.getItem(SESSION_KEY);
+    if (!id) {
+        id = newSessionId();
+        sessionStorage.setItem(SESSION_KEY, id);
+    }
+    return id;
+}
+
+// fetch() for backend endpoints, tagged with this tab's session.
+export function apiFetch(url, options = {}) {
+    return fetch(url, { ...options, headers: { ...options.headers, "X-Session-Id": sessionId() } });
+}